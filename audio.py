@@ -0,0 +1,538 @@
+"""
+Декодирование и нарезка аудио в памяти.
+
+Голосовое сообщение декодируется один раз через пайпы ffmpeg (stdin/stdout)
+в моно PCM 16 кГц, а куски для распознавания - это срезы одного буфера без
+копирования и без временных файлов на диске (копируются только куски, из
+которых вырезаны длинные паузы). В формате 'flac' все куски
+дополнительно кодируются во FLAC одним процессом ffmpeg и отправляются
+распознавателю как есть, без повторного кодирования.
+
+Границы кусков выбираются в паузах по энергии сигнала (VAD), тишина в
+начале и конце кусков обрезается, а полностью тихие участки вообще не
+отправляются на распознавание. Фразы склеиваются в куски до chunk_duration,
+а длинные паузы между ними вырезаются, поэтому запросов к распознавателю
+меньше, чем при нарезке равными кусками.
+
+Большие файлы обрабатываются потоково: decode_stream() декодирует файл по
+мере скачивания, а stream_chunks() с StreamSplitter отдает куски, как только
+их границы определены, поэтому распознавание начинается с первого куска, а
+память не растет с длиной записи. Контейнеры, которые нельзя прочитать из
+пайпа (MP4/MOV с индексом в конце файла), сначала сохраняются во временный
+файл на диске.
+
+Процессы ffmpeg запускаются и читаются через asyncio, поэтому ожидание
+декодирования и кодирования не занимает поток: в одном цикле событий
+обрабатывается сколько угодно сообщений одновременно.
+"""
+import asyncio
+import logging
+import os
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import speech_recognition as sr
+
+from metrics import record_span, span
+
+logger = logging.getLogger(__name__)
+
+# Распознавателю речи достаточно 16 кГц моно
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2  # pcm_s16le
+
+# Минимальный порог RMS энергии кадра, ниже которого кадр всегда считается тишиной
+MIN_ENERGY_THRESHOLD = 100
+
+
+def _decode_args(sample_rate, source='pipe:0'):
+    return [
+        'ffmpeg',
+        '-v', 'error',
+        '-i', source,
+        '-f', 's16le',
+        '-acodec', 'pcm_s16le',
+        '-ac', '1',
+        '-ar', str(sample_rate),
+        'pipe:1'
+    ]
+
+
+def decode_audio(data, sample_rate=SAMPLE_RATE, timeout=120):
+    """
+    Декодирует аудиофайл из байтов в моно PCM (int16) одним процессом ffmpeg.
+    """
+    result = subprocess.run(_decode_args(sample_rate), input=data, capture_output=True, timeout=timeout)
+
+    if result.returncode != 0:
+        logger.error(f"Ошибка ffmpeg: {result.stderr.decode(errors='replace')}")
+        raise subprocess.CalledProcessError(result.returncode, 'ffmpeg')
+
+    return np.frombuffer(result.stdout, dtype=np.int16)
+
+
+async def decode_stream(blocks, sample_rate=SAMPLE_RATE, block_duration=1.0, timeout=120, seekable=False):
+    """
+    Декодирует файл, приходящий блоками байтов (асинхронный итератор,
+    например тело ответа при скачивании), и отдает PCM блоками по
+    block_duration секунд, не дожидаясь конца файла.
+
+    timeout - сколько можно ждать следующего блока PCM, прежде чем считать,
+    что скачивание или ffmpeg зависли. Пока потребитель занят, срок не идет.
+
+    seekable=True - для контейнеров, которые ffmpeg может прочитать только с
+    перемещением по файлу (MP4/MOV/M4A с индексом moov в конце, как пишут
+    телефоны): файл сначала целиком сохраняется во временный файл на диске,
+    и декодирование начинается после скачивания. Память и в этом случае не
+    растет с длиной файла.
+
+    Скачивание и декодирование идут одновременно с распознаванием, поэтому в
+    трассу они попадают в конце потока этапами 'download.body' (сколько
+    ждали блоков из сети, атрибут bytes - сколько получено) и 'decode'
+    (сколько ждали PCM от ffmpeg).
+    """
+    started = time.monotonic()
+    errors = []
+    received = [0, 0.0]  # байт скачано, секунд ожидания сети
+
+    async def copy(write):
+        """Передает блоки в write, считая полученные байты и время ожидания сети."""
+        waited = time.monotonic()
+        async for block in blocks:
+            received[1] += time.monotonic() - waited
+            received[0] += len(block)
+            await write(block)
+            waited = time.monotonic()
+        received[1] += time.monotonic() - waited
+
+    spool = None
+    if seekable:
+        # Зависшее скачивание здесь прерывает таймаут чтения HTTP, а не таймаут ниже
+        spool = tempfile.NamedTemporaryFile(prefix='s2txt-')
+
+        async def write(block):
+            spool.write(block)
+
+        try:
+            await copy(write)
+            spool.flush()
+        except BaseException:
+            spool.close()
+            record_span('download.body', started, received[1], bytes=received[0])
+            raise
+        args = _decode_args(sample_rate, spool.name)
+        stdin = asyncio.subprocess.DEVNULL
+    else:
+        args = _decode_args(sample_rate)
+        stdin = asyncio.subprocess.PIPE
+    try:
+        process = await asyncio.create_subprocess_exec(*args, stdin=stdin, stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.PIPE)
+    except BaseException:
+        if spool is not None:
+            spool.close()
+        raise
+
+    async def feed():
+        async def write(block):
+            process.stdin.write(block)
+            await process.stdin.drain()
+
+        try:
+            await copy(write)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            # Ошибка скачивания: ffmpeg получит обрезанный файл, ошибку выбросим после чтения
+            errors.append(e)
+        finally:
+            process.stdin.close()
+
+    feeder = None if seekable else asyncio.ensure_future(feed())
+    stderr = asyncio.ensure_future(process.stderr.read())
+
+    block_size = int(sample_rate * block_duration) * SAMPLE_WIDTH
+    decoding = 0.0
+    expired = False
+    try:
+        while True:
+            reading_since = time.monotonic()
+            try:
+                data = await asyncio.wait_for(process.stdout.readexactly(block_size), timeout)
+            except asyncio.IncompleteReadError as e:
+                # Конец файла: последний блок короче остальных
+                data = e.partial
+            except asyncio.TimeoutError:
+                expired = True
+                data = b''
+            decoding += time.monotonic() - reading_since
+            if not data:
+                break
+            yield np.frombuffer(data, dtype=np.int16)
+            if len(data) < block_size:
+                break
+        if not expired:
+            await process.wait()
+    finally:
+        if process.returncode is None:
+            # Потребитель остановился раньше конца файла или ffmpeg завис
+            process.kill()
+            await process.wait()
+        if feeder is not None and not feeder.done():
+            feeder.cancel()
+        # ffmpeg уже завершен, поэтому чтение его stderr заканчивается сразу
+        await asyncio.gather(stderr, *([feeder] if feeder else []), return_exceptions=True)
+        if spool is not None:
+            spool.close()
+        record_span('download.body', started, received[1], bytes=received[0])
+        record_span('decode', started, decoding)
+
+    if expired:
+        raise subprocess.TimeoutExpired(args, timeout)
+    if errors:
+        raise errors[0]
+    if process.returncode != 0:
+        logger.error(f"Ошибка ffmpeg: {stderr.result().decode(errors='replace')}")
+        raise subprocess.CalledProcessError(process.returncode, 'ffmpeg')
+
+
+def to_audio_data(samples, sample_rate=SAMPLE_RATE):
+    """Оборачивает срез PCM в sr.AudioData без копирования данных."""
+    return sr.AudioData(memoryview(samples).cast('B'), sample_rate, SAMPLE_WIDTH)
+
+
+class FlacAudioData(sr.AudioData):
+    """
+    AudioData с заранее закодированным FLAC.
+
+    recognize_google запрашивает get_flac_data() и получает готовые байты
+    вместо повторного запуска кодировщика flac. Исходный PCM сохраняется
+    для других распознавателей и для кэша.
+    """
+
+    def __init__(self, frame_data, sample_rate, sample_width, flac_data):
+        super().__init__(frame_data, sample_rate, sample_width)
+        self.flac_data = flac_data
+
+    def get_flac_data(self, convert_rate=None, convert_width=None):
+        if convert_rate in (None, self.sample_rate) and convert_width in (None, self.sample_width):
+            return self.flac_data
+        return super().get_flac_data(convert_rate, convert_width)
+
+
+async def encode_flac(samples, segments, sample_rate=SAMPLE_RATE, timeout=120):
+    """
+    Кодирует куски PCM во FLAC одним процессом ffmpeg.
+
+    Каждый кусок пишется в отдельный пайп, поэтому на сообщение запускается
+    один кодировщик, а не по процессу flac на каждый кусок. timeout - сколько
+    можно ждать кодировщик; по его истечении процесс останавливается.
+    """
+    loop = asyncio.get_running_loop()
+    pipes = [os.pipe() for _ in segments]
+    args = _encode_args(segments, [w for _, w in pipes], sample_rate)
+
+    try:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *args, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE, pass_fds=[w for _, w in pipes])
+        finally:
+            for _, write_fd in pipes:
+                os.close(write_fd)
+    except BaseException:
+        for read_fd, _ in pipes:
+            os.close(read_fd)
+        raise
+
+    transports = []
+
+    async def feed():
+        try:
+            process.stdin.write(memoryview(samples).cast('B'))
+            await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            process.stdin.close()
+
+    try:
+        # Выходы вычитываются одновременно с подачей PCM, иначе ffmpeg заблокируется на полном пайпе
+        readers = []
+        for read_fd, _ in pipes:
+            reader = asyncio.StreamReader()
+            transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader),
+                                                        os.fdopen(read_fd, 'rb', buffering=0))
+            transports.append(transport)
+            readers.append(reader)
+        _, stderr, *outputs = await asyncio.wait_for(
+            asyncio.gather(feed(), process.stderr.read(), *(reader.read() for reader in readers)), timeout)
+        # Все выходы уже закрыты, но процесс может зависнуть и при завершении
+        returncode = await asyncio.wait_for(process.wait(), timeout)
+    except asyncio.TimeoutError:
+        raise subprocess.TimeoutExpired(args, timeout)
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        for transport in transports:
+            transport.close()
+    if returncode != 0:
+        logger.error(f"Ошибка ffmpeg: {stderr.decode(errors='replace')}")
+        raise subprocess.CalledProcessError(returncode, 'ffmpeg')
+
+    return outputs
+
+
+def _encode_args(segments, write_fds, sample_rate):
+    args = [
+        'ffmpeg',
+        '-v', 'error',
+        '-f', 's16le',
+        '-ar', str(sample_rate),
+        '-ac', '1',
+        '-i', 'pipe:0'
+    ]
+    for (start, end), write_fd in zip(segments, write_fds):
+        args += [
+            '-ss', f'{start / sample_rate:.6f}',
+            '-to', f'{end / sample_rate:.6f}',
+            '-acodec', 'flac',
+            '-f', 'flac',
+            f'pipe:{write_fd}'
+        ]
+    return args
+
+
+def frame_energy(samples, sample_rate=SAMPLE_RATE, frame_duration=0.03):
+    """Возвращает RMS энергию последовательных кадров и размер кадра в отсчетах."""
+    frame_size = int(sample_rate * frame_duration)
+    n_frames = len(samples) // frame_size
+    frames = samples[:n_frames * frame_size].reshape(n_frames, frame_size).astype(np.float32)
+    return np.sqrt(np.mean(frames ** 2, axis=1)), frame_size
+
+
+def find_speech_segments(samples, sample_rate=SAMPLE_RATE, max_duration=30,
+                         frame_duration=0.03, min_pause=0.3, min_speech=0.2,
+                         padding=0.15, energy_threshold=None):
+    """
+    Находит фразы длиной не более max_duration секунд с границами в паузах.
+
+    Возвращает список пар (начало, конец) в отсчетах. Тишина по краям фраз
+    обрезается, участки без речи пропускаются. В куски для распознавания
+    фразы склеивает pack_segments.
+    """
+    energy, frame_size = frame_energy(samples, sample_rate, frame_duration)
+    if not len(energy):
+        return []
+
+    if energy_threshold is None:
+        # Порог между уровнем шума (нижние кадры) и уровнем речи (верхние кадры)
+        noise, peak = np.percentile(energy, [10, 95])
+        energy_threshold = max(MIN_ENERGY_THRESHOLD, noise + (peak - noise) * 0.1)
+
+    voiced = np.concatenate(([False], energy > energy_threshold, [False]))
+    edges = np.diff(voiced.astype(np.int8))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if not len(starts):
+        return []
+
+    # Короткие паузы внутри фраз не считаются границами
+    long_gaps = (starts[1:] - ends[:-1]) >= int(min_pause / frame_duration)
+    starts = starts[np.concatenate(([True], long_gaps))]
+    ends = ends[np.concatenate((long_gaps, [True]))]
+
+    # Отбрасываем щелчки и короткие всплески шума
+    speech = (ends - starts) >= int(min_speech / frame_duration)
+    pad = int(padding / frame_duration)
+    starts = np.maximum(starts[speech] - pad, 0)
+    ends = np.minimum(ends[speech] + pad, len(energy))
+
+    max_frames = int(max_duration / frame_duration)
+    search_frames = max_frames // 4
+
+    # Непрерывную речь длиннее max_duration режем в самом тихом кадре у конца окна
+    pieces = []
+    for start, end in zip(starts, ends):
+        while end - start > max_frames:
+            window = energy[start + max_frames - search_frames:start + max_frames]
+            cut = start + max_frames - search_frames + int(np.argmin(window))
+            pieces.append((start, cut))
+            start = cut
+        pieces.append((start, end))
+
+    return [(int(start) * frame_size, int(end) * frame_size) for start, end in pieces]
+
+
+def pack_segments(segments, sample_rate=SAMPLE_RATE, max_duration=30, max_pause=2.0):
+    """
+    Склеивает фразы (см. find_speech_segments) по порядку в куски длиной не
+    более max_duration секунд.
+
+    Возвращает список кусков, кусок - список участков (начало, конец) в
+    отсчетах. Паузы не длиннее max_pause секунд остаются в куске, а более
+    длинные вырезаются: соседние участки склеиваются встык, и между фразами
+    остается только тишина по их краям. Поэтому в кусок помещается больше
+    речи, а запросов к распознавателю нужно меньше.
+    """
+    max_samples = int(max_duration * sample_rate)
+    max_gap = int(max_pause * sample_rate)
+    chunks = []
+    length = 0
+    for start, end in segments:
+        if chunks:
+            last_start, last_end = chunks[-1][-1]
+            joined = start - last_end <= max_gap
+            added = end - last_end if joined else end - start
+            if length + added <= max_samples:
+                if joined:
+                    chunks[-1][-1] = (last_start, end)
+                else:
+                    chunks[-1].append((start, end))
+                length += added
+                continue
+        chunks.append([(start, end)])
+        length = end - start
+    return chunks
+
+
+def fixed_segments(samples, sample_rate=SAMPLE_RATE, max_duration=30):
+    """Делит запись на куски фиксированной длины max_duration секунд."""
+    chunk_size = int(max_duration * sample_rate)
+    return [
+        (int(start), int(min(start + chunk_size, len(samples))))
+        for start in np.arange(0, len(samples), chunk_size)
+    ]
+
+
+async def split_audio(samples, sample_rate=SAMPLE_RATE, chunk_duration=30, strategy='vad', audio_format='pcm',
+                max_pause=2.0):
+    """
+    Разбивает PCM на части не длиннее chunk_duration для облегчения распознавания.
+
+    strategy='vad' режет по паузам, пропускает тишину и вырезает из кусков
+    паузы длиннее max_pause секунд (см. find_speech_segments и
+    pack_segments), strategy='fixed' режет через равные промежутки.
+    audio_format='flac' заранее кодирует куски во FLAC.
+    """
+    segments = _find_segments(samples, sample_rate, chunk_duration, strategy, max_pause)
+    return await _make_chunks(samples, segments, sample_rate, audio_format)
+
+
+class StreamSplitter:
+    """
+    Потоковая нарезка PCM на куски.
+
+    feed() принимает очередной блок и возвращает буфер и куски в нем (см.
+    pack_segments), которые уже не изменятся; последний найденный кусок
+    может продолжиться в следующих блоках, поэтому он остается в буфере,
+    пока не начался больше двух chunk_duration назад. В памяти держится не
+    больше двух chunk_duration нераспределенного звука.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, chunk_duration=30, strategy='vad', max_pause=2.0):
+        self.sample_rate = sample_rate
+        self.chunk_duration = chunk_duration
+        self.strategy = strategy
+        self.max_pause = max_pause
+        self.samples = 0  # всего получено отсчетов
+        self._window = 2 * int(chunk_duration * sample_rate)
+        # Хвост тишины, который сохраняется на случай, если речь начнется на границе блока
+        self._tail = sample_rate // 2
+        self._buffer = np.zeros(0, dtype=np.int16)
+
+    def feed(self, block):
+        self.samples += len(block)
+        self._buffer = np.concatenate((self._buffer, block))
+        buffer = self._buffer
+        if len(buffer) < self._window:
+            return buffer, []
+        chunks = _find_segments(buffer, self.sample_rate, self.chunk_duration, self.strategy, self.max_pause)
+        if not chunks:
+            ready, rest = [], max(0, len(buffer) - self._tail)
+        elif len(buffer) - chunks[-1][0][0] > self._window:
+            # Последний кусок начался давно, а за ним в основном тишина, которая в кусок не войдет:
+            # он отдается как есть, чтобы буфер не рос с длиной паузы
+            ready, rest = chunks, max(chunks[-1][-1][1], len(buffer) - self._tail)
+        else:
+            ready, rest = chunks[:-1], chunks[-1][0][0]
+        self._buffer = buffer[rest:]
+        return buffer, ready
+
+    def flush(self):
+        """Куски из остатка буфера после конца записи."""
+        buffer, self._buffer = self._buffer, np.zeros(0, dtype=np.int16)
+        if not len(buffer):
+            return buffer, []
+        return buffer, _find_segments(buffer, self.sample_rate, self.chunk_duration, self.strategy, self.max_pause)
+
+
+async def stream_chunks(blocks, splitter, audio_format='pcm'):
+    """
+    Режет поток блоков PCM (см. decode_stream) на куски по мере поступления.
+    Поиск пауз считается numpy по всему окну, поэтому выполняется в потоке и
+    не задерживает цикл событий.
+    """
+    try:
+        async for block in blocks:
+            buffer, chunks = await asyncio.to_thread(splitter.feed, block)
+            for audio_data in await _make_chunks(buffer, chunks, splitter.sample_rate, audio_format):
+                yield audio_data
+        buffer, chunks = await asyncio.to_thread(splitter.flush)
+        for audio_data in await _make_chunks(buffer, chunks, splitter.sample_rate, audio_format):
+            yield audio_data
+    finally:
+        aclose = getattr(blocks, 'aclose', None)
+        if aclose:
+            await aclose()
+
+
+def _find_segments(samples, sample_rate, chunk_duration, strategy, max_pause=2.0):
+    """Куски для распознавания: список кусков, кусок - список участков (начало, конец)."""
+    with span('segment', strategy=strategy) as attrs:
+        if strategy == 'fixed':
+            chunks = [[segment] for segment in fixed_segments(samples, sample_rate, chunk_duration)]
+        else:
+            segments = find_speech_segments(samples, sample_rate, chunk_duration)
+            chunks = pack_segments(segments, sample_rate, chunk_duration, max_pause)
+        attrs['audio_seconds'] = round(len(samples) / sample_rate, 2)
+        attrs['speech_seconds'] = round(
+            sum(end - start for chunk in chunks for start, end in chunk) / sample_rate, 2
+        )
+    return chunks
+
+
+def _join_chunks(samples, chunks):
+    """
+    Склеивает участки каждого куска в новый буфер. Возвращает буфер и границы
+    кусков в нем; куски из одного участка не копируются.
+    """
+    if all(len(chunk) == 1 for chunk in chunks):
+        return samples, [chunk[0] for chunk in chunks]
+    joined = np.concatenate([samples[start:end] for chunk in chunks for start, end in chunk])
+    segments = []
+    offset = 0
+    for chunk in chunks:
+        length = sum(end - start for start, end in chunk)
+        segments.append((offset, offset + length))
+        offset += length
+    return joined, segments
+
+
+async def _make_chunks(samples, chunks, sample_rate, audio_format):
+    samples, segments = _join_chunks(samples, chunks)
+    if audio_format == 'flac' and segments:
+        with span('encode', chunks=len(segments)):
+            flac_chunks = await encode_flac(samples, segments, sample_rate)
+        return _flac_chunks(samples, segments, flac_chunks, sample_rate)
+    return [to_audio_data(samples[start:end], sample_rate) for start, end in segments]
+
+
+def _flac_chunks(samples, segments, flac_chunks, sample_rate):
+    return [
+        FlacAudioData(memoryview(samples[start:end]).cast('B'), sample_rate, SAMPLE_WIDTH, flac_data)
+        for (start, end), flac_data in zip(segments, flac_chunks)
+    ]
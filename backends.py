@@ -0,0 +1,221 @@
+"""
+Сервисы распознавания речи.
+
+Каждый сервис реализует recognize() для одного куска и recognize_batch()
+для пачки кусков, а конвейер на asyncio вызывает их асинхронные варианты
+recognize_async() и recognize_batch_async(). Сервисы с batch_size > 1
+получают куски пачками за один вызов. Сервис выбирается по имени через get_backend(); экземпляр создается
+один раз на процесс, поэтому офлайн модель загружается только при первом
+обращении.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+
+import aiohttp
+import speech_recognition as sr
+from telebot import asyncio_helper
+
+try:
+    from speech_recognition.recognizers.google import ENDPOINT, OutputParser, create_request_builder
+except ImportError:
+    # В старых версиях speech_recognition запрос к Google не вынесен из recognize_google
+    create_request_builder = None
+
+logger = logging.getLogger(__name__)
+
+
+class RecognitionBackend:
+    """Базовый интерфейс сервиса распознавания."""
+
+    name = 'base'
+    batch_size = 1
+
+    def recognize(self, audio_data):
+        """
+        Возвращает текст куска. Если речь не распознана, выбрасывает
+        sr.UnknownValueError, при ошибке сервиса - sr.RequestError.
+        """
+        raise NotImplementedError
+
+    def recognize_batch(self, chunks):
+        """Возвращает тексты кусков по порядку; пустая строка - речь не распознана."""
+        texts = []
+        for audio_data in chunks:
+            try:
+                texts.append(self.recognize(audio_data))
+            except sr.UnknownValueError:
+                texts.append('')
+        return texts
+
+    async def recognize_async(self, audio_data):
+        """recognize() для цикла событий; по умолчанию выполняется в потоке, чтобы не блокировать цикл."""
+        return await asyncio.to_thread(self.recognize, audio_data)
+
+    async def recognize_batch_async(self, chunks):
+        """recognize_batch() для цикла событий."""
+        texts = []
+        for audio_data in chunks:
+            try:
+                texts.append(await self.recognize_async(audio_data))
+            except sr.UnknownValueError:
+                texts.append('')
+        return texts
+
+class GoogleBackend(RecognitionBackend):
+    """
+    Google Speech Recognition через speech_recognition.
+
+    В recognize_async запрос собирает и ответ разбирает сама библиотека
+    (RequestBuilder и OutputParser), а отправляется он через общую сессию
+    aiohttp клиента Bot API, без отдельного потока на запрос. Со старыми
+    версиями speech_recognition recognize_google вызывается в потоке.
+    """
+
+    name = 'google'
+
+    def __init__(self, language='ru-RU', timeout=60):
+        self.language = language
+        self.timeout = timeout
+
+    def recognize(self, audio_data):
+        recognizer = sr.Recognizer()
+        recognizer.operation_timeout = self.timeout
+        return recognizer.recognize_google(audio_data, language=self.language)
+
+    async def recognize_async(self, audio_data):
+        if create_request_builder is None:
+            return await super().recognize_async(audio_data)
+        builder = create_request_builder(endpoint=ENDPOINT, language=self.language)
+        # Куски audio.FlacAudioData уже закодированы, остальные кодирует программа flac
+        data = await asyncio.to_thread(builder.build_data, audio_data)
+        session = await asyncio_helper.session_manager.get_session()
+        try:
+            async with session.post(builder.build_url(), data=data, headers=builder.build_headers(audio_data),
+                                    timeout=aiohttp.ClientTimeout(total=self.timeout)) as response:
+                response.raise_for_status()
+                text = await response.text()
+        except aiohttp.ClientResponseError as e:
+            raise sr.RequestError(f"recognition request failed: {e.message}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise sr.RequestError(f"recognition connection failed: {e!r}")
+        return OutputParser(show_all=False, with_confidence=False).parse(text)
+
+
+class VoskBackend(RecognitionBackend):
+    """
+    Офлайн распознавание на CPU с помощью Vosk.
+
+    Пачки не поддерживаются (batch_size = 1): BatchRecognizer в Vosk есть
+    только в сборке для GPU, а на CPU KaldiRecognizer декодирует один поток,
+    так что пачка свелась бы к циклу. Распознавание занимает CPU, поэтому
+    recognize_async выполняет его в потоке, и куски распознаются
+    параллельно; декодер Kaldi при этом не держит GIL.
+    """
+
+    name = 'vosk'
+
+    def __init__(self, model_path='model'):
+        try:
+            import vosk
+        except ImportError:
+            raise RuntimeError("Для офлайн распознавания установите пакет vosk: pip install vosk")
+        vosk.SetLogLevel(-1)
+        self._vosk = vosk
+        logger.info(f"Загрузка модели Vosk из {model_path}...")
+        self.model = vosk.Model(model_path)
+
+    def recognize(self, audio_data):
+        # Модель общая, распознаватель у каждого куска свой
+        recognizer = self._vosk.KaldiRecognizer(self.model, audio_data.sample_rate)
+        recognizer.AcceptWaveform(bytes(audio_data.get_raw_data(convert_width=2)))
+        text = json.loads(recognizer.FinalResult()).get('text', '')
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+
+class FakeBackend(RecognitionBackend):
+    """
+    Детерминированная заглушка для тестов и бенчмарков.
+
+    Текст зависит только от содержимого куска. Задержка и доля ошибок
+    сервиса настраиваются, ошибки воспроизводимы при одинаковом seed.
+    """
+
+    name = 'fake'
+
+    def __init__(self, latency=0.0, per_second=0.0, error_rate=0.0, batch_size=1, seed=0):
+        self.latency = latency
+        self.per_second = per_second
+        self.error_rate = error_rate
+        self.batch_size = batch_size
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def recognize(self, audio_data):
+        text = self.recognize_batch([audio_data])[0]
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+    def recognize_batch(self, chunks):
+        delay, failed = self._call(chunks)
+        time.sleep(delay)
+        return self._result(chunks, failed)
+
+    async def recognize_async(self, audio_data):
+        text = (await self.recognize_batch_async([audio_data]))[0]
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+    async def recognize_batch_async(self, chunks):
+        delay, failed = self._call(chunks)
+        await asyncio.sleep(delay)
+        return self._result(chunks, failed)
+
+    def _call(self, chunks):
+        """Учитывает вызов; возвращает задержку ответа и признак искусственной ошибки."""
+        seconds = sum(len(c.frame_data) / (c.sample_rate * c.sample_width) for c in chunks)
+        with self._lock:
+            self.calls += 1
+            failed = self._random.random() < self.error_rate
+        return self.latency + seconds * self.per_second, failed
+
+    def _result(self, chunks, failed):
+        if failed:
+            raise sr.RequestError("Искусственная ошибка сервиса")
+        return [self._text(c) for c in chunks]
+
+    @staticmethod
+    def _text(audio_data):
+        if not any(audio_data.frame_data):
+            return ''
+        digest = hashlib.sha256(audio_data.frame_data).hexdigest()[:8]
+        seconds = len(audio_data.frame_data) / (audio_data.sample_rate * audio_data.sample_width)
+        return f'фрагмент {digest} ({seconds:.1f} с)'
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name, **options):
+    """Возвращает общий для процесса экземпляр сервиса распознавания по имени."""
+    factories = {
+        'google': GoogleBackend,
+        'vosk': VoskBackend,
+        'fake': FakeBackend,
+    }
+    if name not in factories:
+        raise ValueError(f"Неизвестный сервис распознавания: {name}")
+    with _backends_lock:
+        if name not in _backends:
+            _backends[name] = factories[name](**options)
+        return _backends[name]
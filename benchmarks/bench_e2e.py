@@ -0,0 +1,291 @@
+"""
+Сквозной бенчмарк бота под нагрузкой.
+
+Запускает main.py отдельным процессом против локального фейкового Bot API
+(benchmarks.fake_telegram) с заглушкой распознавателя (RECOGNITION_BACKEND=fake),
+отправляет синтетические голосовые сообщения разной длины и измеряет:
+- задержку от получения сообщения до "Полный текст" (p50/p95/p99);
+- задержку до первого распознанного текста (p50);
+- пропускную способность, сообщений в минуту;
+- пиковый RSS процесса бота (и процессов-обработчиков с --workers);
+- число запущенных процессов ffmpeg (всего и одновременно);
+- число исходящих вызовов Bot API (sendMessage, editMessageText).
+
+Запуск из корня репозитория (нужен ffmpeg с libopus):
+    python -m benchmarks.bench_e2e --messages 20 --durations 10 30 120 --latency 0.5
+Параметры бота (MAX_WORKERS, SPLIT_STRATEGY и т.д.) передаются через
+окружение или --env KEY=VALUE. С --webhook бот принимает обновления через
+вебхук, на который их доставляет фейковый Bot API. С --workers N сообщения
+обрабатывают N процессов worker.py из долговременной очереди заданий.
+--kind задает тип вложения (голосовое, аудиофайл, видеосообщение, документ),
+а --download-rate ограничивает скорость скачивания файлов, чтобы увидеть,
+что распознавание длинных записей начинается до конца скачивания:
+    python -m benchmarks.bench_e2e --messages 2 --durations 3600 --kind audio --download-rate 64
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+
+from benchmarks.fake_telegram import FakeTelegram
+from benchmarks.synthetic import synthetic_voice
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_TOKEN = '123456:bench'
+BENCH_USER_ID = 42
+
+# Ответы бота, завершающие обработку сообщения, и их исход
+FINAL_REPLIES = [
+    ('📄 Полный текст', 'ok'),
+    ('😔', 'no_speech'),
+    ('🔇', 'no_speech'),
+    ('🚦', 'rejected'),
+    ('⚠️ Извините', 'error'),
+    ('⚠️ Превышено', 'error'),
+    ('⚠️ Не удалось обработать', 'error'),
+]
+
+
+class Tracker:
+    """Сопоставляет итоговые ответы бота с отправленными сообщениями (FIFO по чату)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = defaultdict(deque)
+        self.results = []  # (задержка, исход)
+        self.first_text = []  # задержка до первого распознанного текста
+        self._first_seen = set()
+        self.done = threading.Event()
+        self.expected = 0
+
+    def sent(self, chat_id, received):
+        with self._lock:
+            self._pending[chat_id].append(received)
+            self.expected += 1
+
+    def reply(self, now, method, params):
+        text = params.get('text', '')
+        outcome = next((o for prefix, o in FINAL_REPLIES if text.startswith(prefix)), None)
+        if outcome is None:
+            # Первая распознанная часть: отдельное сообщение или текст в статусном сообщении
+            if text.startswith('Часть ') or (text.startswith('📝 Распознано') and '\n\n' in text):
+                with self._lock:
+                    pending = self._pending[int(params['chat_id'])]
+                    if pending and (params['chat_id'], pending[0]) not in self._first_seen:
+                        self._first_seen.add((params['chat_id'], pending[0]))
+                        self.first_text.append(now - pending[0])
+            return
+        with self._lock:
+            pending = self._pending[int(params['chat_id'])]
+            if not pending:
+                return
+            self.results.append((now - pending.popleft(), outcome))
+            if len(self.results) >= self.expected:
+                self.done.set()
+
+
+def proc_status(pid, field):
+    """Значение поля /proc/<pid>/status в килобайтах или 0."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def process_tree():
+    """Словарь pid -> (имя, ppid) всех процессов."""
+    processes = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # Поле comm может содержать пробелы, ppid идет вторым после закрывающей скобки
+        comm = stat.split('(', 1)[1].rsplit(')', 1)[0]
+        processes[int(entry)] = (comm, int(stat.rsplit(')', 1)[1].split()[1]))
+    return processes
+
+
+def descendants(processes, roots):
+    """pid всех потомков процессов roots."""
+    result = []
+    for pid in processes:
+        parent = processes[pid][1]
+        while parent and parent not in roots:
+            parent = processes.get(parent, (None, 0))[1]
+        if parent:
+            result.append(pid)
+    return result
+
+
+def make_ffmpeg_shim(directory):
+    """Обертка ffmpeg, которая считает запуски и передает управление настоящему ffmpeg."""
+    real_ffmpeg = shutil.which('ffmpeg')
+    if not real_ffmpeg:
+        sys.exit('ffmpeg не найден в PATH')
+    counter = os.path.join(directory, 'ffmpeg_calls')
+    open(counter, 'w').close()
+    shim = os.path.join(directory, 'ffmpeg')
+    with open(shim, 'w') as f:
+        f.write(f'#!/bin/sh\necho $$ >> "{counter}"\nexec "{real_ffmpeg}" "$@"\n')
+    os.chmod(shim, 0o755)
+    return counter
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=20, help='количество голосовых сообщений')
+    parser.add_argument('--durations', type=float, nargs='+', default=[10, 30, 120],
+                        help='длительности сообщений, секунд (по кругу)')
+    parser.add_argument('--chats', type=int, default=4, help='количество чатов, между которыми делятся сообщения')
+    parser.add_argument('--interval', type=float, default=0.0,
+                        help='пауза между сообщениями, секунд (0 - все сразу)')
+    parser.add_argument('--latency', type=float, default=0.5, help='задержка заглушки распознавателя, секунд')
+    parser.add_argument('--per-second', type=float, default=0.01,
+                        help='добавочная задержка распознавателя на секунду аудио')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ошибок сервиса распознавания')
+    parser.add_argument('--timeout', type=float, default=600, help='максимальное время ожидания, секунд')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='дополнительные переменные окружения бота')
+    parser.add_argument('--webhook', action='store_true', help='прием обновлений через вебхук вместо long polling')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='число процессов worker.py с долговременной очередью заданий (0 - обработка в боте)')
+    parser.add_argument('--kind', default='voice', choices=['voice', 'audio', 'video_note', 'document'],
+                        help='тип вложения в сообщениях')
+    parser.add_argument('--download-rate', type=float, default=0,
+                        help='скорость скачивания файлов, КиБ/с (0 - без ограничения)')
+    args = parser.parse_args()
+
+    print('Генерация синтетических сообщений...', flush=True)
+    voices = {}
+    for duration in set(args.durations):
+        voices[duration] = [synthetic_voice(duration, seed=i) for i in range(args.messages)]
+
+    fake = FakeTelegram(download_rate=args.download_rate * 1024 or None).start()
+    tracker = Tracker()
+    fake.on_message(tracker.reply)
+
+    workdir = tempfile.mkdtemp(prefix='s2txt-bench-')
+    counter = make_ffmpeg_shim(workdir)
+    env = dict(os.environ)
+    env.update({
+        'TOKEN': BENCH_TOKEN,
+        'ALLOWED_USER_ID': str(BENCH_USER_ID),
+        'TELEGRAM_API_URL': fake.url,
+        'RECOGNITION_BACKEND': 'fake',
+        'RECOGNITION_BACKEND_OPTIONS': json.dumps({
+            'latency': args.latency,
+            'per_second': args.per_second,
+            'error_rate': args.error_rate,
+        }),
+        'CACHE_PATH': '',
+        'PATH': workdir + os.pathsep + env.get('PATH', ''),
+    })
+    if args.webhook:
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        env.update({'WEBHOOK_URL': f'http://127.0.0.1:{port}/telegram', 'WEBHOOK_PORT': str(port)})
+    if args.workers:
+        env.update({'JOB_QUEUE_PATH': os.path.join(workdir, 'jobs.sqlite3'), 'WORKER_PROCESSES': str(args.workers)})
+    env.update(item.split('=', 1) for item in args.env)
+
+    bot = subprocess.Popen([sys.executable, os.path.join(ROOT, 'main.py')], cwd=workdir, env=env,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    processes = [bot]
+    if args.workers:
+        processes.append(subprocess.Popen([sys.executable, os.path.join(ROOT, 'worker.py')], cwd=workdir, env=env,
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    peak_children = 0
+    worker_rss = {}
+    sampling = threading.Event()
+
+    def sample():
+        nonlocal peak_children
+        roots = {process.pid for process in processes}
+        while not sampling.is_set():
+            tree = process_tree()
+            children = descendants(tree, roots)
+            peak_children = max(peak_children, sum(1 for pid in children if tree[pid][0] == 'ffmpeg'))
+            for pid in children:
+                if tree[pid][0] != 'ffmpeg':
+                    worker_rss[pid] = max(worker_rss.get(pid, 0), proc_status(pid, 'VmHWM'))
+            time.sleep(0.05)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+
+    try:
+        started = time.monotonic()
+        for i in range(args.messages):
+            duration = args.durations[i % len(args.durations)]
+            chat_id = 1000 + i % args.chats
+            # Время получения фиксируется до того, как бот сможет забрать обновление
+            tracker.sent(chat_id, time.monotonic())
+            fake.push_voice(chat_id, BENCH_USER_ID, voices[duration][i], duration, kind=args.kind)
+            if args.interval:
+                time.sleep(args.interval)
+
+        if not tracker.done.wait(args.timeout):
+            print(f'Таймаут: обработано {len(tracker.results)} из {args.messages}')
+        elapsed = time.monotonic() - started
+        peak_rss = proc_status(bot.pid, 'VmHWM')
+        if args.workers:
+            worker_rss[processes[1].pid] = proc_status(processes[1].pid, 'VmHWM')
+    finally:
+        sampling.set()
+        for process in processes:
+            process.send_signal(signal.SIGTERM)
+        for process in processes:
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        fake.stop()
+
+    with open(counter) as f:
+        ffmpeg_calls = sum(1 for _ in f)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = np.array([latency for latency, outcome in tracker.results if outcome == 'ok'])
+    outcomes = defaultdict(int)
+    for _, outcome in tracker.results:
+        outcomes[outcome] += 1
+
+    print(f"messages:          {args.messages} ({', '.join(f'{k}: {v}' for k, v in sorted(outcomes.items()))})")
+    if len(latencies):
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        print(f"latency p50/p95/p99: {p50:.2f} / {p95:.2f} / {p99:.2f} s")
+    if tracker.first_text:
+        print(f"first text p50:    {np.percentile(tracker.first_text, 50):.2f} s")
+    print(f"throughput:        {len(tracker.results) / elapsed * 60:.1f} msg/min")
+    print(f"peak RSS:          {peak_rss / 1024:.1f} MiB")
+    if worker_rss:
+        print(f"worker peak RSS:   {max(worker_rss.values()) / 1024:.1f} MiB max per process, "
+              f"{len(worker_rss)} processes")
+    print(f"ffmpeg processes:  {ffmpeg_calls} total, {peak_children} peak concurrent")
+    calls = defaultdict(int)
+    for _, method, _ in fake.sent:
+        calls[method] += 1
+    print(f"bot API calls:     {', '.join(f'{k}: {v}' for k, v in sorted(calls.items()))}")
+
+
+if __name__ == '__main__':
+    main()
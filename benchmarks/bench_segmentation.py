@@ -0,0 +1,67 @@
+"""
+Сравнение нарезки аудио фиксированными кусками и по паузам (VAD).
+
+Для каждой стратегии выводятся число кусков, суммарная длительность
+отправленного на распознавание аудио и время обработки с заглушкой
+распознавателя, задержка которой растет с длиной куска.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_segmentation --durations 30 120 300
+    python -m benchmarks.bench_segmentation --file voice.ogg
+"""
+import argparse
+import asyncio
+import time
+
+import speech_recognition as sr
+
+from audio import SAMPLE_RATE, SAMPLE_WIDTH, decode_audio, split_audio
+from backends import FakeBackend
+from recognition import recognize_chunks
+from benchmarks.synthetic import synthetic_speech
+
+
+async def run(samples, strategy, args):
+    started = time.perf_counter()
+    chunks = await split_audio(samples, SAMPLE_RATE, args.chunk_duration, strategy, max_pause=args.max_pause)
+    backend = FakeBackend(latency=args.latency, per_second=args.per_second)
+    async for _, future in recognize_chunks(chunks, backend, max_in_flight=args.concurrency):
+        try:
+            await future
+        except sr.UnknownValueError:
+            pass
+    wall = time.perf_counter() - started
+    sent = sum(len(chunk.frame_data) for chunk in chunks) / (SAMPLE_RATE * SAMPLE_WIDTH)
+    return len(chunks), sent, wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--durations', type=float, nargs='+', default=[30, 120, 300],
+                        help='длительности синтетических записей, секунд')
+    parser.add_argument('--file', help='реальный аудиофайл вместо синтетических записей')
+    parser.add_argument('--chunk-duration', type=int, default=30)
+    parser.add_argument('--max-pause', type=float, default=2.0,
+                        help='пауза, длиннее которой vad вырезает ее из куска, секунд')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='число одновременных запросов к заглушке распознавателя')
+    parser.add_argument('--latency', type=float, default=0.3, help='задержка одного запроса, секунд')
+    parser.add_argument('--per-second', type=float, default=0.01,
+                        help='добавочная задержка на секунду аудио, секунд')
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, 'rb') as f:
+            inputs = [(args.file, decode_audio(f.read()))]
+    else:
+        inputs = [(f'synthetic {d:g}s', synthetic_speech(d)) for d in args.durations]
+
+    print(f"{'input':<20} {'strategy':<8} {'chunks':>6} {'audio sent, s':>14} {'wall, s':>8}")
+    for name, samples in inputs:
+        for strategy in ('fixed', 'vad'):
+            chunks, sent, wall = asyncio.run(run(samples, strategy, args))
+            print(f"{name:<20} {strategy:<8} {chunks:>6} {sent:>14.1f} {wall:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
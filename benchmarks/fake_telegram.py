@@ -0,0 +1,230 @@
+"""
+Локальный сервер, имитирующий Telegram Bot API для бенчмарков.
+
+Поддерживает getUpdates (long polling), вебхук (setWebhook), getFile,
+скачивание файлов (с ограничением скорости, чтобы имитировать большие файлы)
+и отправку, редактирование и удаление сообщений. Бот направляется на него
+через TELEGRAM_API_URL (apihelper.API_URL / apihelper.FILE_URL).
+"""
+import json
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+class FakeTelegram:
+    """Состояние фейкового Bot API: очередь обновлений, файлы и отправленные сообщения."""
+
+    def __init__(self, host='127.0.0.1', port=0, download_rate=None):
+        self._condition = threading.Condition()
+        self._updates = []
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self.files = {}      # file_id -> содержимое
+        self.sent = []       # (время, метод, параметры)
+        self._listeners = []
+        self.webhook = None  # (адрес, секрет), если бот зарегистрировал вебхук
+        self.download_rate = download_rate  # байт в секунду при скачивании файлов, None - без ограничения
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._condition:
+            self._condition.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def on_message(self, listener):
+        """Регистрирует listener(время, метод, параметры) для исходящих сообщений бота."""
+        self._listeners.append(listener)
+
+    def push_voice(self, chat_id, user_id, data, duration, kind='voice'):
+        """
+        Добавляет входящее сообщение с аудио в очередь обновлений. kind - тип
+        вложения: 'voice', 'audio', 'video_note' или 'document' (файл audio/ogg).
+        """
+        with self._condition:
+            file_id = f'{kind}-{self._next_update_id}'
+            self.files[file_id] = data
+            media = {
+                'file_id': file_id,
+                'file_unique_id': file_id,
+                'mime_type': 'audio/ogg',
+                'file_size': len(data),
+            }
+            if kind == 'document':
+                media['file_name'] = f'{file_id}.ogg'
+            else:
+                media['duration'] = int(duration)
+            if kind == 'video_note':
+                media['length'] = 240
+            message = {
+                'message_id': self._new_message_id(),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench'},
+                kind: media,
+            }
+            self._updates.append({'update_id': self._next_update_id, 'message': message})
+            self._next_update_id += 1
+            self._condition.notify_all()
+            if self.webhook:
+                self._deliver_pending()
+
+    def _deliver_pending(self):
+        """Отправляет накопленные обновления на вебхук, как это делает Telegram."""
+        url, secret = self.webhook
+        for update in self._updates:
+            threading.Thread(target=self._post_update, args=(url, secret, update), daemon=True).start()
+        self._updates = []
+
+    @staticmethod
+    def _post_update(url, secret, update):
+        request = urllib.request.Request(url, data=json.dumps(update).encode(), headers={
+            'Content-Type': 'application/json',
+            'X-Telegram-Bot-Api-Secret-Token': secret or '',
+        })
+        for _ in range(10):
+            try:
+                with urllib.request.urlopen(request, timeout=10):
+                    return
+            except OSError:
+                # Telegram повторяет доставку, пока вебхук не ответит успешно
+                time.sleep(0.5)
+
+    def _set_webhook(self, params):
+        with self._condition:
+            self.webhook = (params['url'], params.get('secret_token')) if params.get('url') else None
+            if self.webhook:
+                self._deliver_pending()
+        return True
+
+    def _new_message_id(self):
+        message_id = self._next_message_id
+        self._next_message_id += 1
+        return message_id
+
+    def _get_updates(self, params):
+        offset = int(params.get('offset', 0))
+        timeout = float(params.get('timeout', 0))
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                updates = [u for u in self._updates if u['update_id'] >= offset]
+                # Подтвержденные ботом обновления больше не нужны
+                self._updates = updates
+                remaining = deadline - time.monotonic()
+                if updates or remaining <= 0:
+                    return updates[:int(params.get('limit', 100))]
+                self._condition.wait(remaining)
+
+    def _get_file(self, params):
+        file_id = params['file_id']
+        return {
+            'file_id': file_id,
+            'file_unique_id': file_id,
+            'file_size': len(self.files[file_id]),
+            'file_path': f'voice/{file_id}.oga',
+        }
+
+    def _message(self, method, params):
+        with self._condition:
+            message_id = int(params.get('message_id') or self._new_message_id())
+        now = time.monotonic()
+        self.sent.append((now, method, params))
+        for listener in self._listeners:
+            listener(now, method, params)
+        return {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': int(params['chat_id']), 'type': 'private'},
+            'from': {'id': 1, 'is_bot': True, 'first_name': 'bot'},
+            'text': params.get('text', ''),
+        }
+
+    def call(self, method, params):
+        """Выполняет метод Bot API и возвращает поле result ответа."""
+        if method == 'getUpdates':
+            return self._get_updates(params)
+        if method == 'getFile':
+            return self._get_file(params)
+        if method in ('sendMessage', 'editMessageText'):
+            return self._message(method, params)
+        if method == 'setWebhook':
+            return self._set_webhook(params)
+        if method == 'deleteWebhook':
+            return self._set_webhook({})
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'bot', 'username': 'bench_bot'}
+        return True
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body, content_type='application/json'):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # клиент закрыл соединение, например прерванный long polling при остановке бота
+
+            def _stream(self, body, rate, block_size=16 * 1024):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                try:
+                    for start in range(0, len(body), block_size):
+                        self.wfile.write(body[start:start + block_size])
+                        time.sleep(block_size / rate)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def _handle(self):
+                url = urlsplit(self.path)
+                params = dict(parse_qsl(url.query))
+                length = int(self.headers.get('Content-Length') or 0)
+                if length and self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+                    params.update(parse_qsl(self.rfile.read(length).decode()))
+
+                parts = url.path.strip('/').split('/')
+                if parts[0] == 'file':
+                    file_id = parts[-1].rsplit('.', 1)[0]
+                    if file_id not in fake.files:
+                        return self._reply(404, b'')
+                    if fake.download_rate:
+                        return self._stream(fake.files[file_id], fake.download_rate)
+                    return self._reply(200, fake.files[file_id], 'application/octet-stream')
+
+                try:
+                    result = fake.call(parts[-1], params)
+                    body = {'ok': True, 'result': result}
+                    status = 200
+                except KeyError as e:
+                    body = {'ok': False, 'error_code': 400, 'description': f'Bad Request: {e}'}
+                    status = 400
+                self._reply(status, json.dumps(body).encode())
+
+            do_GET = _handle
+            do_POST = _handle
+
+        return Handler
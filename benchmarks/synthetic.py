@@ -0,0 +1,50 @@
+"""
+Генератор синтетических "голосовых" записей для бенчмарков.
+
+Речь имитируется шумом, модулированным по амплитуде с частотой слогов,
+паузы - тихим фоновым шумом. Между фразами встречаются и длинные паузы.
+"""
+import subprocess
+
+import numpy as np
+
+from audio import SAMPLE_RATE
+
+
+def synthetic_speech(duration, sample_rate=SAMPLE_RATE, seed=0, speech_level=3000, noise_level=30):
+    """Возвращает моно PCM (int16) длительностью duration секунд."""
+    rng = np.random.default_rng(seed)
+    total = int(duration * sample_rate)
+    parts = []
+    length = 0
+    phrase = 0
+    while length < total:
+        n = int(rng.uniform(1, 6) * sample_rate)
+        envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * np.arange(n) / sample_rate)
+        parts.append(rng.normal(0, speech_level, n) * envelope)
+        # Каждая пятая пауза длинная: собеседник задумался или отвлекся
+        pause = 8 if phrase % 5 == 4 else rng.uniform(0.1, 2.5)
+        m = int(pause * sample_rate)
+        parts.append(rng.normal(0, noise_level, m))
+        length += n + m
+        phrase += 1
+    samples = np.concatenate(parts)[:total]
+    return np.clip(samples, -32768, 32767).astype(np.int16)
+
+
+def synthetic_voice(duration, seed=0, sample_rate=SAMPLE_RATE):
+    """Синтетическое голосовое сообщение в OGG/Opus, как их присылает Telegram."""
+    samples = synthetic_speech(duration, sample_rate, seed)
+    result = subprocess.run([
+        'ffmpeg',
+        '-v', 'error',
+        '-f', 's16le',
+        '-ar', str(sample_rate),
+        '-ac', '1',
+        '-i', 'pipe:0',
+        '-acodec', 'libopus',
+        '-b:a', '32k',
+        '-f', 'ogg',
+        'pipe:1'
+    ], input=samples.tobytes(), capture_output=True, check=True)
+    return result.stdout
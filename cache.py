@@ -0,0 +1,259 @@
+"""
+Кэш результатов распознавания.
+
+Два уровня ключей: file_unique_id голосового сообщения (готовая расшифровка
+целиком) и хэш содержимого декодированного куска (текст куска). Записи
+хранятся в LRU в памяти и в SQLite на диске с вытеснением по возрасту (TTL)
+и по количеству записей: на диске вытесняются записи, к которым дольше всего
+не обращались, в том числе через LRU в памяти.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import speech_recognition as sr
+
+from backends import RecognitionBackend
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Время обращения к записям, найденным в памяти, записывается на диск пачками по столько записей
+TOUCH_BATCH = 100
+# Лишние записи на диске вытесняются раз в столько сохранений, а не при каждом
+EVICT_INTERVAL = 100
+
+
+class TranscriptCache:
+    """LRU кэш в памяти с необязательным хранилищем SQLite."""
+
+    def __init__(self, path=None, max_entries=10000, ttl=30 * 24 * 3600, memory_entries=256):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (value, created)
+        self._touched = {}            # key -> время обращения, еще не записанное на диск
+        self._puts = 0
+        self._hits = 0
+        self._misses = 0
+        # Счетчики Prometheus видны с нуля, даже пока к кэшу не обращались
+        metrics.inc('s2txt_cache_hits_total', 0)
+        metrics.inc('s2txt_cache_misses_total', 0)
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            # WAL позволяет нескольким процессам-обработчикам читать кэш во время записи
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS transcripts (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+            """)
+            # Вытеснение выбирает записи по времени обращения и по возрасту, без сортировки всей таблицы
+            self._db.execute("CREATE INDEX IF NOT EXISTS transcripts_accessed ON transcripts (accessed)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS transcripts_created ON transcripts (created)")
+            self._db.commit()
+
+    def get(self, key):
+        """Возвращает значение по ключу или None, если записи нет или она устарела."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and now - entry[1] < self.ttl:
+                self._memory.move_to_end(key)
+                self._hits += 1
+                metrics.inc('s2txt_cache_hits_total')
+                if self._db is not None:
+                    # Иначе горячие записи выглядели бы на диске невостребованными и вытеснялись первыми
+                    self._touched[key] = now
+                    if len(self._touched) >= TOUCH_BATCH:
+                        try:
+                            self._flush_touched()
+                            self._db.commit()
+                        except sqlite3.Error as e:
+                            logger.warning(f"Ошибка записи в кэш: {e}")
+                return entry[0]
+            self._memory.pop(key, None)
+
+            if self._db is not None:
+                try:
+                    row = self._db.execute(
+                        "SELECT value, created FROM transcripts WHERE key = ? AND created > ?",
+                        (key, now - self.ttl)
+                    ).fetchone()
+                    if row:
+                        self._db.execute("UPDATE transcripts SET accessed = ? WHERE key = ?", (now, key))
+                        self._db.commit()
+                        value = json.loads(row[0])
+                        self._remember(key, value, row[1])
+                        self._hits += 1
+                        metrics.inc('s2txt_cache_hits_total')
+                        return value
+                except sqlite3.Error as e:
+                    logger.warning(f"Ошибка чтения кэша: {e}")
+
+            self._misses += 1
+            metrics.inc('s2txt_cache_misses_total')
+            return None
+
+    def put(self, key, value):
+        """Сохраняет значение (сериализуемое в JSON) по ключу."""
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            if self._db is None:
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO transcripts (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), now, now)
+                )
+                self._puts += 1
+                if self._puts % EVICT_INTERVAL == 0:
+                    self._flush_touched()
+                    self._evict(now)
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Ошибка записи в кэш: {e}")
+
+    def stats(self):
+        """
+        Счетчики попаданий и промахов и число записей для команды status.
+        Число записей на диске считается запросом COUNT(*), поэтому метрики
+        Prometheus берут попадания и промахи из счетчиков, а не отсюда.
+        """
+        with self._lock:
+            disk_entries = 0
+            if self._db is not None:
+                disk_entries = self._db.execute("SELECT COUNT(*) FROM transcripts").fetchone()[0]
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'memory_entries': len(self._memory),
+                'disk_entries': disk_entries,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                try:
+                    self._flush_touched()
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"Ошибка записи в кэш: {e}")
+                self._db.close()
+                self._db = None
+
+    def _remember(self, key, value, created):
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _flush_touched(self):
+        touched, self._touched = self._touched, {}
+        if touched:
+            self._db.executemany(
+                "UPDATE transcripts SET accessed = MAX(accessed, ?) WHERE key = ?",
+                [(accessed, key) for key, accessed in touched.items()]
+            )
+
+    def _evict(self, now):
+        self._db.execute("DELETE FROM transcripts WHERE created <= ?", (now - self.ttl,))
+        self._db.execute("""
+            DELETE FROM transcripts WHERE key IN (
+                SELECT key FROM transcripts ORDER BY accessed DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+
+
+def audio_key(audio_data, namespace=''):
+    """Ключ куска по хэшу его PCM содержимого, параметрам формата и сервису распознавания."""
+    digest = hashlib.sha256(audio_data.frame_data)
+    digest.update(f'{audio_data.sample_rate}:{audio_data.sample_width}'.encode())
+    return f'chunk:{namespace}:{digest.hexdigest()}'
+
+
+class CachedBackend(RecognitionBackend):
+    """
+    Обертка сервиса распознавания с кэшем по содержимому куска.
+
+    Нераспознанная речь кэшируется пустой строкой и снова превращается
+    в sr.UnknownValueError при попадании. В асинхронных вариантах обращения
+    к кэшу (и к SQLite) выполняются в потоке, чтобы не задерживать цикл событий.
+    """
+
+    def __init__(self, backend, cache):
+        self.backend = backend
+        self.cache = cache
+        self.name = backend.name
+        self.batch_size = backend.batch_size
+
+    def recognize(self, audio_data):
+        key = audio_key(audio_data, self.name)
+        text = self.cache.get(key)
+        if text is None:
+            try:
+                text = self.backend.recognize(audio_data)
+            except sr.UnknownValueError:
+                self.cache.put(key, '')
+                raise
+            self.cache.put(key, text)
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+    def recognize_batch(self, chunks):
+        keys = [audio_key(audio_data, self.name) for audio_data in chunks]
+        texts = [self.cache.get(key) for key in keys]
+        missing = [j for j, text in enumerate(texts) if text is None]
+        if missing:
+            # В сервис уходят только куски, которых нет в кэше
+            results = self.backend.recognize_batch([chunks[j] for j in missing])
+            for j, text in zip(missing, results):
+                self.cache.put(keys[j], text)
+                texts[j] = text
+        return texts
+
+    async def recognize_async(self, audio_data):
+        key = audio_key(audio_data, self.name)
+        text = await asyncio.to_thread(self.cache.get, key)
+        if text is None:
+            try:
+                text = await self.backend.recognize_async(audio_data)
+            except sr.UnknownValueError:
+                await asyncio.to_thread(self.cache.put, key, '')
+                raise
+            await asyncio.to_thread(self.cache.put, key, text)
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+    async def recognize_batch_async(self, chunks):
+        keys = [audio_key(audio_data, self.name) for audio_data in chunks]
+        texts = await asyncio.to_thread(self._get_many, keys)
+        missing = [j for j, text in enumerate(texts) if text is None]
+        if missing:
+            # В сервис уходят только куски, которых нет в кэше
+            results = await self.backend.recognize_batch_async([chunks[j] for j in missing])
+            for j, text in zip(missing, results):
+                texts[j] = text
+            await asyncio.to_thread(self._put_many, [(keys[j], texts[j]) for j in missing])
+        return texts
+
+    def _get_many(self, keys):
+        return [self.cache.get(key) for key in keys]
+
+    def _put_many(self, items):
+        for key, text in items:
+            self.cache.put(key, text)
@@ -0,0 +1,278 @@
+"""
+Долговременная очередь заданий на SQLite.
+
+Бот только записывает голосовые сообщения в очередь, а обрабатывают их
+отдельные процессы (worker.py), поэтому задания переживают перезапуск бота
+и обработчиков. База работает в режиме WAL, чтобы несколько процессов
+могли одновременно читать очередь и по одному записывать в нее.
+
+Обработчик берет задание в аренду и продлевает ее, пока работает. Если
+процесс упал, аренда истекает и задание забирает другой обработчик.
+Результаты распознанных кусков сохраняются как контрольные точки, поэтому
+повторная обработка продолжается с места остановки. Задания одного чата
+выполняются строго по очереди, как и в JobScheduler.
+"""
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Сколько хранить выполненные задания для статистики, секунд
+KEEP_FINISHED = 7 * 24 * 3600
+
+
+class LeaseLost(Exception):
+    """Аренду задания забрал другой обработчик; эта попытка прекращается молча."""
+
+
+class JobQueue:
+    """Очередь заданий в файле SQLite, общая для бота и процессов-обработчиков."""
+
+    def __init__(self, path, lease=60, max_queue=None, max_attempts=3):
+        self.path = path
+        self.lease = lease
+        self.max_queue = max_queue
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                lease_until REAL,
+                created REAL NOT NULL,
+                updated REAL NOT NULL,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                job_id INTEGER NOT NULL,
+                chunk INTEGER NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (job_id, chunk)
+            );
+            CREATE TABLE IF NOT EXISTS workers (
+                id TEXT PRIMARY KEY,
+                busy INTEGER NOT NULL,
+                heartbeat REAL NOT NULL
+            );
+        """)
+
+    @contextmanager
+    def _transaction(self):
+        """Транзакция с блокировкой записи сразу, чтобы два процесса не взяли одно задание."""
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield self._db
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def submit(self, key, payload):
+        """
+        Добавляет задание. Возвращает 0, если его сразу возьмет свободный
+        обработчик, иначе позицию в очереди, как JobScheduler.submit.
+        При переполнении выбрасывает queue.Full.
+        """
+        key = str(key)
+        now = time.time()
+        with self._lock, self._transaction() as db:
+            ahead_keys = [row[0] for row in db.execute("SELECT key FROM jobs WHERE status = 'queued'")]
+            if self.max_queue is not None and len(ahead_keys) >= self.max_queue:
+                raise queue.Full
+            active_keys = {row[0] for row in db.execute(
+                "SELECT key FROM jobs WHERE status = 'running' AND lease_until >= ?", (now,)
+            )}
+            workers, busy = self._workers(db, now)
+            db.execute(
+                "INSERT INTO jobs (key, payload, created, updated) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(payload, ensure_ascii=False), now, now)
+            )
+            runnable_ahead = len({k for k in ahead_keys if k not in active_keys})
+            if key not in active_keys and key not in ahead_keys and runnable_ahead < workers - busy:
+                return 0
+            return len(ahead_keys) + 1
+
+    def claim(self, worker):
+        """
+        Берет в аренду первое задание, чат которого сейчас не обрабатывается,
+        включая задания с истекшей арендой. Возвращает (id, payload, номер попытки,
+        время постановки в очередь) или None.
+        """
+        now = time.time()
+        with self._lock, self._transaction() as db:
+            self._touch(db, worker, busy=False, now=now)
+            # Задания, которые уже несколько раз роняли обработчик, больше не берем
+            failed = db.execute("""
+                UPDATE jobs SET status = 'failed', error = 'lease expired', updated = ?
+                WHERE status = 'running' AND lease_until < ? AND attempts >= ?
+            """, (now, now, self.max_attempts)).rowcount
+            if failed:
+                logger.error(f"Задания отменены после {self.max_attempts} попыток: {failed}")
+
+            row = db.execute("""
+                SELECT id, payload, attempts,
+                       CASE WHEN status = 'running' THEN lease_until ELSE updated END AS queued_at
+                FROM jobs AS j
+                WHERE (status = 'queued' OR (status = 'running' AND lease_until < :now))
+                  AND NOT EXISTS (
+                      SELECT 1 FROM jobs AS r
+                      WHERE r.key = j.key AND r.id != j.id AND r.status = 'running' AND r.lease_until >= :now
+                  )
+                ORDER BY id LIMIT 1
+            """, {'now': now}).fetchone()
+            if row is None:
+                return None
+            job_id, payload, attempts, queued_at = row
+            if attempts:
+                logger.warning(f"Задание {job_id} взято повторно (попытка {attempts + 1})")
+            db.execute("""
+                UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1, updated = ?
+                WHERE id = ?
+            """, (worker, now + self.lease, now, job_id))
+            self._touch(db, worker, busy=True, now=now)
+            return job_id, json.loads(payload), attempts + 1, queued_at
+
+    def heartbeat(self, job_id, worker):
+        """Продлевает аренду. Возвращает False, если задание уже забрал другой обработчик."""
+        now = time.time()
+        with self._lock, self._transaction() as db:
+            self._touch(db, worker, busy=True, now=now)
+            return db.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (now + self.lease, job_id, worker)
+            ).rowcount == 1
+
+    def complete(self, job_id, worker):
+        """Отмечает задание выполненным и удаляет его контрольные точки."""
+        self._finish(job_id, worker, 'done')
+
+    def fail(self, job_id, worker, error, retry=True):
+        """
+        Отмечает неудачную попытку. Если retry и попытки не исчерпаны, задание
+        возвращается в очередь вместе с контрольными точками, иначе отмечается
+        неудачным. Возвращает True, если задание будет повторено.
+        """
+        now = time.time()
+        with self._lock, self._transaction() as db:
+            row = db.execute("SELECT attempts FROM jobs WHERE id = ? AND worker = ? AND status = 'running'",
+                             (job_id, worker)).fetchone()
+            if retry and row is not None and row[0] < self.max_attempts:
+                # Задание остается первым в очереди своего чата, поэтому порядок сообщений сохраняется
+                db.execute(
+                    "UPDATE jobs SET status = 'queued', worker = NULL, lease_until = NULL, error = ?, updated = ? "
+                    "WHERE id = ?",
+                    (str(error), now, job_id)
+                )
+                self._touch(db, worker, busy=False, now=now)
+                return True
+        self._finish(job_id, worker, 'failed', str(error))
+        return False
+
+    def release(self, job_id, worker):
+        """Возвращает задание в очередь (например, при остановке обработчика); контрольные точки сохраняются."""
+        now = time.time()
+        with self._lock, self._transaction() as db:
+            db.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL, lease_until = NULL, updated = ? "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (now, job_id, worker)
+            )
+            self._touch(db, worker, busy=False, now=now)
+
+    def checkpoints(self, job_id):
+        """Сохраненные результаты кусков задания: {номер куска: значение}."""
+        with self._lock:
+            rows = self._db.execute("SELECT chunk, value FROM checkpoints WHERE job_id = ?", (job_id,))
+            return {chunk: json.loads(value) for chunk, value in rows}
+
+    def save_checkpoint(self, job_id, chunk, value):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO checkpoints (job_id, chunk, value) VALUES (?, ?, ?)",
+                (job_id, chunk, json.dumps(value, ensure_ascii=False))
+            )
+
+    def stats(self):
+        """Статистика в том же формате, что и JobScheduler.stats()."""
+        now = time.time()
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            workers, busy = self._workers(self._db, now)
+        return {
+            'workers': workers,
+            'busy': busy,
+            'queued': counts.get('queued', 0),
+            'max_queue': self.max_queue,
+            'processed': counts.get('done', 0),
+            'failed': counts.get('failed', 0),
+            'utilisation': busy / workers if workers else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _finish(self, job_id, worker, status, error=None):
+        now = time.time()
+        with self._lock, self._transaction() as db:
+            finished = db.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_until = NULL, updated = ? WHERE id = ? AND worker = ?",
+                (status, error, now, job_id, worker)
+            ).rowcount
+            # Контрольные точки задания, которое уже забрал другой обработчик, ему еще нужны
+            if finished:
+                db.execute("DELETE FROM checkpoints WHERE job_id = ?", (job_id,))
+            db.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated < ?", (now - KEEP_FINISHED,))
+            self._touch(db, worker, busy=False, now=now)
+
+    def _workers(self, db, now):
+        """Число живых обработчиков (с недавним обращением к очереди) и занятых из них."""
+        return db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(busy), 0) FROM workers WHERE heartbeat > ?", (now - self.lease,)
+        ).fetchone()
+
+    @staticmethod
+    def _touch(db, worker, busy, now):
+        db.execute("INSERT OR REPLACE INTO workers (id, busy, heartbeat) VALUES (?, ?, ?)",
+                   (worker, int(busy), now))
+
+
+class JobCheckpoints:
+    """
+    Контрольные точки одного задания для process_recognition. Если попытка не
+    последняя (final=False), конвейер не сообщает пользователю об ошибках, а
+    выбрасывает их, чтобы обработчик вернул задание в очередь через fail.
+
+    lost - событие потери аренды: после него check() выбрасывает LeaseLost,
+    и конвейер больше ничего не отправляет, чтобы ответы не дублировались
+    с обработчиком, который забрал задание.
+    """
+
+    def __init__(self, jobs, job_id, final=True, lost=None):
+        self.jobs = jobs
+        self.job_id = job_id
+        self.final = final
+        self.lost = lost or threading.Event()
+
+    def check(self):
+        if self.lost.is_set():
+            raise LeaseLost(f"аренда задания {self.job_id} потеряна")
+
+    def load(self):
+        return self.jobs.checkpoints(self.job_id)
+
+    def save(self, chunk, value):
+        self.jobs.save_checkpoint(self.job_id, chunk, value)
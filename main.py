@@ -1,17 +1,23 @@
 import telebot
-import speech_recognition as sr
-import os
-import numpy as np
-import subprocess
+import asyncio
 import time
 import logging
-import threading
+import queue
 from telebot.handler_backends import State
-from requests.exceptions import ReadTimeout, ConnectionError, HTTPError
-from telebot import apihelper
+from requests.exceptions import ReadTimeout, ConnectionError
+from telebot.async_telebot import AsyncTeleBot
 import signal
 import sys
 
+from metrics import configure_trace_log, metrics, start_metrics_server
+from pipeline import (MEDIA_CONTENT_TYPES, close_bot_session, configure_bot_api, create_backend, create_cache,
+                      create_job_queue, is_media_message, process_voice_message, run_voice_job, safe_bot_operation,
+                      safe_bot_operation_async)
+from scheduler import AsyncJobScheduler, JobScheduler
+from settings import (ALLOWED_USER_ID, MAX_QUEUE_SIZE, MAX_WORKERS, METRICS_HOST, METRICS_PORT, RUNTIME, TOKEN,
+                      TRACE_LOG, WEBHOOK_HOST, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_URL)
+from webhook import start_webhook_server, start_webhook_server_async
+
 # Настройка системы логирования для отслеживания работы бота
 logging.basicConfig(
     level=logging.INFO,
@@ -23,22 +29,18 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Получение токена и ID пользователя из переменных окружения
-TOKEN = os.getenv('TOKEN')
-ALLOWED_USER_ID = int(os.getenv('ALLOWED_USER_ID')) if os.getenv('ALLOWED_USER_ID') else None
-
-# Если переменные окружения не установлены, пытаемся импортировать из конфига
 if not TOKEN or not ALLOWED_USER_ID:
-    try:
-        from config import TOKEN, ALLOWED_USER_ID
-        ALLOWED_USER_ID = int(ALLOWED_USER_ID)
-    except ImportError:
-        logger.error("Токен и ID пользователя не найдены!")
-        sys.exit(1)
+    logger.error("Токен и ID пользователя не найдены!")
+    sys.exit(1)
 
-# Создание директории для временных аудиофайлов
-TEMP_AUDIO_DIR = 'temp_audio'
-os.makedirs(TEMP_AUDIO_DIR, exist_ok=True)
+WELCOME_TEXT = """
+👋 Добро пожаловать в бот для распознавания речи!
+
+🗣️ Отправьте мне голосовое сообщение, и я преобразую его в текст.
+🎧 Также подходят аудиофайлы, видео и видеосообщения.
+📝 Поддерживается русский язык.
+⚡ Длинные сообщения автоматически разбиваются на части.
+"""
 
 # Глобальная переменная для контроля работы бота
 bot_running = True
@@ -53,36 +55,110 @@ def signal_handler(signum, frame):
 signal.signal(signal.SIGINT, signal_handler)
 signal.signal(signal.SIGTERM, signal_handler)
 
-def safe_bot_operation(bot, operation, *args, **kwargs):
+def serve_webhook(bot):
     """
-    Безопасное выполнение операций с ботом с повторными попытками
+    Прием обновлений через вебхук. Сервер отвечает Telegram сразу, а ошибки
+    исходящих запросов не останавливают прием. Работает, пока бот не остановлен.
     """
-    max_retries = 3
-    for attempt in range(max_retries):
+    server = start_webhook_server(WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET,
+                                  lambda update: bot.process_new_updates([update]))
+    try:
+        # Сервер уже принимает обновления, поэтому регистрация повторяется, пока не удастся,
+        # а ошибка Bot API не останавливает сервер
+        registered = False
+        next_attempt = 0
+        while bot_running:
+            if not registered and time.monotonic() >= next_attempt:
+                try:
+                    safe_bot_operation(bot, bot.set_webhook, url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET,
+                                       allowed_updates=['message'])
+                    registered = True
+                except Exception as e:
+                    logger.error(f"Не удалось зарегистрировать вебхук: {e}. Повторяем через 30с...")
+                    next_attempt = time.monotonic() + 30
+            time.sleep(1)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+async def serve_webhook_async(bot):
+    """Асинхронный вариант serve_webhook; работает до отмены задачи."""
+    runner = await start_webhook_server_async(WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET,
+                                              lambda update: bot.process_new_updates([update]))
+    try:
+        # Сервер уже принимает обновления, поэтому регистрацию можно повторять сколько угодно
+        while True:
+            try:
+                await safe_bot_operation_async(bot, bot.set_webhook, url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET,
+                                               allowed_updates=['message'])
+                break
+            except Exception as e:
+                logger.error(f"Не удалось зарегистрировать вебхук: {e}. Повторяем через 30с...")
+                await asyncio.sleep(30)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+async def poll_async(bot):
+    """Long polling в среде asyncio; перед ним снимается вебхук, если бот раньше работал в режиме вебхука."""
+    while True:
         try:
-            return operation(*args, **kwargs)
-        except (ReadTimeout, ConnectionError, HTTPError) as e:
-            if attempt < max_retries - 1:
-                wait_time = 2 ** attempt  # Экспоненциальная задержка
-                logger.warning(f"Ошибка {type(e).__name__} (попытка {attempt + 1}): {e}. Повторяем через {wait_time}с...")
-                time.sleep(wait_time)
-            else:
-                logger.error(f"Не удалось выполнить операцию после {max_retries} попыток: {e}")
-                raise
+            await safe_bot_operation_async(bot, bot.delete_webhook)
+            break
         except Exception as e:
-            logger.error(f"Неожиданная ошибка при выполнении операции: {e}")
-            raise
+            logger.error(f"Не удалось снять вебхук: {e}. Повторяем через 30с...")
+            await asyncio.sleep(30)
+    await bot.infinity_polling(
+        timeout=15,
+        request_timeout=20,
+        logger_level=logging.WARNING,
+        allowed_updates=['message']
+    )
 
-def cleanup_temp_files():
-    """Очистка всех временных файлов"""
-    try:
-        for filename in os.listdir(TEMP_AUDIO_DIR):
-            filepath = os.path.join(TEMP_AUDIO_DIR, filename)
-            if os.path.isfile(filepath):
-                os.remove(filepath)
-        logger.info("Временные файлы очищены")
-    except Exception as e:
-        logger.warning(f"Ошибка при очистке временных файлов: {e}")
+def create_services(jobs, scheduler_class=JobScheduler):
+    """
+    Создает пул обработчиков (scheduler_class: JobScheduler или, в цикле
+    событий, AsyncJobScheduler), кэш расшифровок и сервис распознавания,
+    регистрирует метрики и при необходимости запускает сервер метрик.
+
+    С очередью заданий jobs распознают процессы-обработчики, поэтому пул и
+    сервис распознавания (а с ним и модель Vosk) не создаются: scheduler и
+    backend равны None, а метрики и статус показывают состояние очереди.
+    """
+    if jobs:
+        scheduler, backend = None, None
+        transcript_cache = create_cache()
+    else:
+        scheduler = scheduler_class(workers=MAX_WORKERS, max_queue=MAX_QUEUE_SIZE)
+        transcript_cache, backend = create_backend()
+    pool = jobs or scheduler
+
+    configure_trace_log(TRACE_LOG)
+    metrics.gauge('s2txt_queue_depth', lambda: pool.stats()['queued'], 'Сообщения в очереди на обработку')
+    metrics.gauge('s2txt_workers_busy', lambda: pool.stats()['busy'], 'Занятые обработчики')
+    metrics.gauge('s2txt_worker_utilisation', lambda: pool.stats()['utilisation'], 'Загрузка пула обработчиков')
+    metrics_server = start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    return scheduler, transcript_cache, backend, metrics_server
+
+def status_text(pool, transcript_cache, counters=True):
+    """
+    Текст ответа на команду status: состояние пула или очереди заданий и кэша.
+    Без counters попадания и промахи не показываются: их считают процессы-обработчики.
+    """
+    stats = pool.stats()
+    cache_stats = transcript_cache.stats()
+    entries = cache_stats['disk_entries'] or cache_stats['memory_entries']
+    if counters:
+        cache_text = f"попаданий {cache_stats['hits']}, промахов {cache_stats['misses']}, записей {entries}"
+    else:
+        cache_text = f"записей {entries}"
+    return (
+        f"👷 Занято обработчиков: {stats['busy']}/{stats['workers']}\n"
+        f"📥 В очереди: {stats['queued']}/{stats['max_queue']}\n"
+        f"✅ Обработано: {stats['processed']}\n"
+        f"📊 Загрузка пула: {stats['utilisation']:.0%}\n"
+        f"🗄️ Кэш: {cache_text}"
+    )
 
 def run_bot():
     """
@@ -91,12 +167,15 @@ def run_bot():
     """
     global bot_running
     
-    # Настройка более коротких таймаутов для раннего обнаружения проблем
-    apihelper.CONNECT_TIMEOUT = 10
-    apihelper.READ_TIMEOUT = 20
+    configure_bot_api()
     
     restart_count = 0
     max_restarts = 10  # Максимальное количество перезапусков подряд
+
+    # Общий пул обработчиков переживает перезапуски бота
+    jobs = create_job_queue()
+    scheduler, transcript_cache, backend, metrics_server = create_services(jobs)
+    pool = jobs or scheduler
     
     while bot_running and restart_count < max_restarts:
         bot = None
@@ -104,60 +183,6 @@ def run_bot():
             logger.info(f"Запуск бота (попытка {restart_count + 1})...")
             bot = telebot.TeleBot(token=TOKEN, threaded=True)
             
-            def split_audio_file(input_file, chunk_duration=30):
-                """
-                Разбивает аудиофайл на части указанной длительности для облегчения распознавания.
-                """
-                try:
-                    # Получаем длительность входного файла
-                    result = subprocess.run([
-                        'ffprobe',
-                        '-v', 'error',
-                        '-show_entries', 'format=duration',
-                        '-of', 'default=noprint_wrappers=1:nokey=1',
-                        input_file
-                    ], capture_output=True, text=True, timeout=30)
-                    
-                    if result.returncode != 0:
-                        raise subprocess.CalledProcessError(result.returncode, 'ffprobe')
-                        
-                    audio_duration = float(result.stdout.strip())
-                    
-                    chunk_paths = []
-                    # Разбиваем файл на куски указанной длительности
-                    for start in np.arange(0, audio_duration, chunk_duration):
-                        end = min(start + chunk_duration, audio_duration)
-                        chunk_filename = os.path.join(
-                            TEMP_AUDIO_DIR,
-                            f'audio_chunk_{int(start)}_{int(time.time())}.wav'
-                        )
-
-                        # Используем ffmpeg для создания куска аудио
-                        result = subprocess.run([
-                            'ffmpeg',
-                            '-i', input_file,
-                            '-ss', str(start),
-                            '-to', str(end),
-                            '-acodec', 'pcm_s16le',
-                            '-ar', '44100',
-                            '-y',  # Перезаписывать файлы без подтверждения
-                            chunk_filename
-                        ], capture_output=True, timeout=60)
-                        
-                        if result.returncode == 0:
-                            chunk_paths.append(chunk_filename)
-                        else:
-                            logger.error(f"Ошибка ffmpeg: {result.stderr.decode()}")
-
-                    return chunk_paths
-                    
-                except subprocess.TimeoutExpired:
-                    logger.error("Таймаут при обработке аудио файла")
-                    return []
-                except Exception as e:
-                    logger.error(f"Ошибка при разбиении аудио файла: {e}")
-                    return []
-
             @bot.message_handler(commands=['start', 'help'])
             def send_welcome(message):
                 """Обработчик команд start и help"""
@@ -165,14 +190,16 @@ def run_bot():
                     safe_bot_operation(bot, bot.reply_to, message, '🚫 Доступ запрещен. Извините.')
                     return
                 
-                welcome_text = """
-👋 Добро пожаловать в бот для распознавания речи!
+                safe_bot_operation(bot, bot.reply_to, message, WELCOME_TEXT.strip())
 
-🗣️ Отправьте мне голосовое сообщение, и я преобразую его в текст.
-📝 Поддерживается русский язык.
-⚡ Длинные сообщения автоматически разбиваются на части.
-                """
-                safe_bot_operation(bot, bot.reply_to, message, welcome_text.strip())
+            @bot.message_handler(commands=['status'])
+            def send_status(message):
+                """Обработчик команды status: состояние очереди обработки"""
+                if message.from_user.id != ALLOWED_USER_ID:
+                    safe_bot_operation(bot, bot.reply_to, message, '🚫 Доступ запрещен. Извините.')
+                    return
+
+                safe_bot_operation(bot, bot.reply_to, message, status_text(pool, transcript_cache, counters=not jobs))
 
             @bot.message_handler(func=lambda message: True, content_types=['text'])
             def text_processing(message):
@@ -183,142 +210,43 @@ def run_bot():
 
                 safe_bot_operation(bot, bot.reply_to, message, '🗣️ Запишите голосовое сообщение, либо перешлите его мне.')
 
-            @bot.message_handler(content_types=['voice'])
+            @bot.message_handler(func=is_media_message, content_types=MEDIA_CONTENT_TYPES)
             def voice_processing(message):
-                """Обработчик голосовых сообщений."""
+                """Обработчик голосовых сообщений и других сообщений с аудио."""
                 if message.from_user.id != ALLOWED_USER_ID:
                     safe_bot_operation(bot, bot.reply_to, message, '🚫 Доступ запрещен. Извините.')
                     return
 
-                # Используем отдельный поток для обработки, чтобы не блокировать polling
-                threading.Thread(target=process_voice_message, args=(bot, message), daemon=True).start()
-
-            def process_voice_message(bot, message):
-                """Обработка голосового сообщения в отдельном потоке"""
-                ogg_filepath = None
-                wav_filepath = None
-                
+                # Передаем обработку в пул или в очередь заданий, чтобы не блокировать polling;
+                # в пуле каждое сообщение обрабатывается конвейером в своем цикле событий
                 try:
-                    safe_bot_operation(bot, bot.reply_to, message, '⌛ Подождите немного, я обрабатываю голосовое сообщение...')
-
-                    # Получение и скачивание файла
-                    file_id = message.voice.file_id
-                    file_info = safe_bot_operation(bot, bot.get_file, file_id)
-                    
-                    if not file_info:
-                        raise Exception("Не удалось получить информацию о файле")
-                        
-                    downloaded_file = safe_bot_operation(bot, bot.download_file, file_info.file_path)
-                    
-                    # Создаем уникальные имена файлов
-                    timestamp = int(time.time())
-                    ogg_filepath = os.path.join(TEMP_AUDIO_DIR, f'audio_{timestamp}.ogg')
-                    wav_filepath = os.path.join(TEMP_AUDIO_DIR, f'audio_{timestamp}.wav')
-
-                    # Сохранение скачанного файла
-                    with open(ogg_filepath, 'wb') as new_file:
-                        new_file.write(downloaded_file)
-
-                    # Конвертация из OGG в WAV с таймаутом
-                    result = subprocess.run([
-                        'ffmpeg',
-                        '-i', ogg_filepath,
-                        '-acodec', 'pcm_s16le',
-                        '-ar', '44100',
-                        '-y',
-                        wav_filepath
-                    ], capture_output=True, timeout=120)
-                    
-                    if result.returncode != 0:
-                        raise subprocess.CalledProcessError(result.returncode, 'ffmpeg')
-
-                    # Разбиение на части и распознавание
-                    chunk_paths = split_audio_file(wav_filepath)
-                    if chunk_paths:
-                        process_recognition(bot, message, chunk_paths)
+                    if jobs:
+                        position = jobs.submit(message.chat.id, message.json)
                     else:
-                        safe_bot_operation(bot, bot.reply_to, message, '⚠️ Не удалось обработать аудио файл.')
-
-                except subprocess.TimeoutExpired:
-                    safe_bot_operation(bot, bot.reply_to, message, '⚠️ Превышено время обработки файла.')
-                    logger.error("Таймаут при конвертации аудио")
-                except Exception as e:
-                    safe_bot_operation(bot, bot.reply_to, message, f'⚠️ Извините, произошла ошибка при подготовке: {str(e)}')
-                    logger.error(f"Ошибка при обработке голосового сообщения: {e}")
-                finally:
-                    # Очистка временных файлов
-                    for filepath in [ogg_filepath, wav_filepath]:
-                        if filepath and os.path.exists(filepath):
-                            try:
-                                os.remove(filepath)
-                            except Exception as e:
-                                logger.warning(f"Не удалось удалить файл {filepath}: {e}")
-
-            def process_recognition(bot, message, chunk_paths):
-                """Выполняет распознавание речи для каждого куска аудио."""
-                recognizer = sr.Recognizer()
-                # Настройка параметров распознавания для лучшей точности
-                recognizer.energy_threshold = 300
-                recognizer.dynamic_energy_threshold = True
-
-                try:
-                    safe_bot_operation(bot, bot.send_message, message.chat.id, '📝 Начинаю распознавание...')
-
-                    recognized_parts = []
-                    # Обработка каждого куска аудио
-                    for i, chunk_path in enumerate(chunk_paths, 1):
-                        try:
-                            with sr.AudioFile(chunk_path) as source:
-                                # Настройка для устранения шума
-                                recognizer.adjust_for_ambient_noise(source, duration=0.5)
-                                audio_data = recognizer.record(source)
-                                
-                                # Распознавание речи с помощью Google Speech Recognition
-                                chunk_text = recognizer.recognize_google(
-                                    audio_data, language='ru-RU')
-                                
-                                if chunk_text.strip():
-                                    recognized_parts.append(chunk_text)
-                                    safe_bot_operation(bot, bot.send_message, message.chat.id, f"Часть {i}: {chunk_text}")
-                                    
-                        except sr.UnknownValueError:
-                            safe_bot_operation(bot, bot.send_message, message.chat.id, f'⚠️ Часть {i}: речь не распознана.')
-                        except sr.RequestError as e:
-                            safe_bot_operation(bot, bot.send_message, message.chat.id, f'⚠️ Часть {i}: ошибка сервиса распознавания.')
-                            logger.error(f"Ошибка сервиса распознавания для части {i}: {e}")
-                        except Exception as e:
-                            safe_bot_operation(bot, bot.send_message, message.chat.id, f'⚠️ Часть {i}: ошибка обработки.')
-                            logger.error(f"Ошибка при распознавании части {i}: {e}")
-                        finally:
-                            # Очистка временных файлов
-                            if os.path.exists(chunk_path):
-                                try:
-                                    os.remove(chunk_path)
-                                except Exception as e:
-                                    logger.warning(f"Не удалось удалить чанк {chunk_path}: {e}")
-
-                    # Отправляем итоговый результат
-                    if recognized_parts:
-                        full_text = " ".join(recognized_parts)
-                        safe_bot_operation(bot, bot.send_message, message.chat.id, f'📄 Полный текст:\n\n{full_text}')
-                    else:
-                        safe_bot_operation(bot, bot.send_message, message.chat.id, '😔 К сожалению, не удалось распознать речь в аудиозаписи.')
-                        
-                    safe_bot_operation(bot, bot.send_message, message.chat.id, '✅ Обработка завершена!')
+                        position = scheduler.submit(message.chat.id, run_voice_job,
+                                                    TOKEN, message, backend, transcript_cache)
+                except queue.Full:
+                    safe_bot_operation(bot, bot.reply_to, message, '🚦 Очередь переполнена, попробуйте отправить сообщение позже.')
+                    logger.warning(f"Очередь переполнена: {pool.stats()}")
+                    return
 
-                except Exception as e:
-                    safe_bot_operation(bot, bot.send_message, message.chat.id, f'⚠️ Извините, произошла ошибка при распознавании: {str(e)}')
-                    logger.error(f"Общая ошибка при распознавании: {e}")
+                if position:
+                    safe_bot_operation(bot, bot.reply_to, message, f'🕒 Сообщение поставлено в очередь, позиция {position}.')
 
-            # Запуск polling с оптимизированными параметрами
             logger.info("Бот успешно запущен и готов к работе!")
-            bot.infinity_polling(
-                timeout=20,           # Таймаут для получения обновлений
-                long_polling_timeout=15,  # Таймаут для long polling
-                logger_level=logging.WARNING,  # Меньше логов от библиотеки
-                restart_on_change=False,
-                allowed_updates=['message']  # Обрабатываем только сообщения
-            )
+            if WEBHOOK_URL:
+                serve_webhook(bot)
+            else:
+                # Вебхук, оставшийся от запуска в режиме вебхука, не дает получать обновления через getUpdates
+                safe_bot_operation(bot, bot.delete_webhook)
+                # Запуск polling с оптимизированными параметрами
+                bot.infinity_polling(
+                    timeout=20,           # Таймаут для получения обновлений
+                    long_polling_timeout=15,  # Таймаут для long polling
+                    logger_level=logging.WARNING,  # Меньше логов от библиотеки
+                    restart_on_change=False,
+                    allowed_updates=['message']  # Обрабатываем только сообщения
+                )
             
         except (ReadTimeout, ConnectionError) as e:
             restart_count += 1
@@ -351,15 +279,110 @@ def run_bot():
     if restart_count >= max_restarts:
         logger.error(f"Достигнуто максимальное количество перезапусков ({max_restarts}). Завершение работы.")
     
-    cleanup_temp_files()
+    if scheduler:
+        scheduler.stop(timeout=5)
+    if metrics_server:
+        metrics_server.shutdown()
+    if jobs:
+        jobs.close()
+    transcript_cache.close()
+    logger.info("Бот завершил работу")
+
+async def run_async_bot():
+    """
+    Запуск бота на asyncio. Прием обновлений (long polling или вебхук),
+    ответы на команды и обработка голосовых сообщений идут в одном цикле
+    событий через одну сессию aiohttp: process_voice_message выполняется
+    задачами AsyncJobScheduler, и потоки заняты только поиском пауз, SQLite
+    и распознавателями, у которых нет асинхронного API (Vosk).
+    """
+    configure_bot_api()
+
+    jobs = create_job_queue()
+    scheduler, transcript_cache, backend, metrics_server = create_services(jobs, AsyncJobScheduler)
+    pool = jobs or scheduler
+    bot = AsyncTeleBot(TOKEN)
+
+    @bot.message_handler(commands=['start', 'help'])
+    async def send_welcome(message):
+        """Обработчик команд start и help"""
+        if message.from_user.id != ALLOWED_USER_ID:
+            await safe_bot_operation_async(bot, bot.reply_to, message, '🚫 Доступ запрещен. Извините.')
+            return
+        await safe_bot_operation_async(bot, bot.reply_to, message, WELCOME_TEXT.strip())
+
+    @bot.message_handler(commands=['status'])
+    async def send_status(message):
+        """Обработчик команды status: состояние очереди обработки"""
+        if message.from_user.id != ALLOWED_USER_ID:
+            await safe_bot_operation_async(bot, bot.reply_to, message, '🚫 Доступ запрещен. Извините.')
+            return
+        text = await asyncio.to_thread(status_text, pool, transcript_cache, not jobs)
+        await safe_bot_operation_async(bot, bot.reply_to, message, text)
+
+    @bot.message_handler(func=lambda message: True, content_types=['text'])
+    async def text_processing(message):
+        """Обработчик текстовых сообщений."""
+        if message.from_user.id != ALLOWED_USER_ID:
+            await safe_bot_operation_async(bot, bot.reply_to, message, '🚫 Доступ запрещен. Извините.')
+            return
+        await safe_bot_operation_async(bot, bot.reply_to, message, '🗣️ Запишите голосовое сообщение, либо перешлите его мне.')
+
+    @bot.message_handler(func=is_media_message, content_types=MEDIA_CONTENT_TYPES)
+    async def voice_processing(message):
+        """Обработчик голосовых сообщений и других сообщений с аудио."""
+        if message.from_user.id != ALLOWED_USER_ID:
+            await safe_bot_operation_async(bot, bot.reply_to, message, '🚫 Доступ запрещен. Извините.')
+            return
+
+        try:
+            if jobs:
+                # Запись в SQLite блокирует, поэтому выполняется вне цикла событий
+                position = await asyncio.to_thread(jobs.submit, message.chat.id, message.json)
+            else:
+                position = scheduler.submit(message.chat.id, process_voice_message,
+                                            bot, message, backend, transcript_cache)
+        except queue.Full:
+            await safe_bot_operation_async(bot, bot.reply_to, message, '🚦 Очередь переполнена, попробуйте отправить сообщение позже.')
+            stats = await asyncio.to_thread(pool.stats)
+            logger.warning(f"Очередь переполнена: {stats}")
+            return
+
+        if position:
+            await safe_bot_operation_async(bot, bot.reply_to, message, f'🕒 Сообщение поставлено в очередь, позиция {position}.')
+
+    # infinity_polling сам переподключается после ошибок сети, поэтому внешний цикл перезапусков не нужен
+    logger.info("Бот успешно запущен и готов к работе (asyncio)!")
+    if WEBHOOK_URL:
+        ingestion = asyncio.create_task(serve_webhook_async(bot))
+    else:
+        ingestion = asyncio.create_task(poll_async(bot))
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, ingestion.cancel)
+    try:
+        await ingestion
+    except asyncio.CancelledError:
+        pass
+    logger.info("Получен сигнал завершения. Останавливаем бота...")
+
+    if scheduler:
+        await scheduler.stop(timeout=5)
+    if metrics_server:
+        metrics_server.shutdown()
+    if jobs:
+        jobs.close()
+    transcript_cache.close()
+    await close_bot_session()
     logger.info("Бот завершил работу")
 
 if __name__ == '__main__':
     try:
-        run_bot()
+        if RUNTIME == 'async':
+            asyncio.run(run_async_bot())
+        else:
+            run_bot()
     except KeyboardInterrupt:
         logger.info("Работа бота прервана пользователем")
     except Exception as e:
         logger.error(f"Критическая ошибка: {e}")
-    finally:
-        cleanup_temp_files()
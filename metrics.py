@@ -0,0 +1,253 @@
+"""
+Метрики и трассировка этапов обработки.
+
+Длительности этапов (скачивание, декодирование, нарезка, распознавание,
+вызовы Bot API) собираются в гистограммы, повторные попытки и паузы между
+ними - в отдельные счетчики. Все метрики отдаются в формате Prometheus
+по HTTP, а для каждого сообщения пишется строка JSON в журнал трасс.
+"""
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+HELP = {
+    's2txt_stage_seconds': 'Длительность этапов обработки голосового сообщения',
+    's2txt_retries_total': 'Количество повторных попыток после ошибок',
+    's2txt_backoff_seconds_total': 'Суммарное время пауз перед повторными попытками',
+    's2txt_messages_total': 'Обработанные голосовые сообщения по исходу',
+    's2txt_webhook_updates_total': 'Запросы к вебхуку по коду ответа',
+    's2txt_cache_hits_total': 'Попадания в кэш расшифровок',
+    's2txt_cache_misses_total': 'Промахи кэша расшифровок',
+}
+
+
+class Metrics:
+    """Потокобезопасный реестр гистограмм, счетчиков и датчиков."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms = {}  # (имя, метки) -> [счетчики корзин..., сумма, количество]
+        self._counters = {}    # (имя, метки) -> значение
+        self._gauges = {}      # имя -> (описание, функция)
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.setdefault(key, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge(self, name, callback, description=''):
+        """Регистрирует датчик, значение которого вычисляется при каждом запросе метрик."""
+        with self._lock:
+            self._gauges[name] = (description, callback)
+
+    def render(self):
+        """Текущие значения в текстовом формате Prometheus."""
+        lines = []
+        with self._lock:
+            histograms = {key: list(value) for key, value in self._histograms.items()}
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+
+        for name in sorted({key[0] for key in histograms}):
+            lines += [f'# HELP {name} {HELP.get(name, name)}', f'# TYPE {name} histogram']
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(self.buckets, values):
+                    lines.append(f'{name}_bucket{_labels(labels, le=bound)} {count}')
+                lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} {values[-1]}')
+                lines.append(f'{name}_sum{_labels(labels)} {values[-2]}')
+                lines.append(f'{name}_count{_labels(labels)} {values[-1]}')
+
+        for name in sorted({key[0] for key in counters}):
+            lines += [f'# HELP {name} {HELP.get(name, name)}', f'# TYPE {name} counter']
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_labels(labels)} {value}')
+
+        for name, (description, callback) in sorted(gauges.items()):
+            try:
+                value = callback()
+            except Exception as e:
+                logger.warning(f"Не удалось получить значение метрики {name}: {e}")
+                continue
+            lines += [f'# HELP {name} {description or name}', f'# TYPE {name} gauge', f'{name} {value}']
+
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+
+
+metrics = Metrics()
+
+
+class Trace:
+    """Трасса обработки одного сообщения: этапы, повторные попытки и атрибуты."""
+
+    def __init__(self, trace_id, **attrs):
+        self.trace_id = trace_id
+        self.attrs = attrs
+        self.started = time.monotonic()
+        self.started_at = time.time()
+        self.spans = []
+        self.retries = []
+        self._lock = threading.Lock()
+
+    def add_span(self, stage, started, duration, **attrs):
+        with self._lock:
+            self.spans.append({
+                'stage': stage,
+                'offset': round(started - self.started, 4),
+                'duration': round(duration, 4),
+                **attrs,
+            })
+
+    def add_retry(self, operation, attempt, wait, error):
+        with self._lock:
+            self.retries.append({'operation': operation, 'attempt': attempt, 'wait': wait, 'error': error})
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'trace_id': self.trace_id,
+                'started_at': self.started_at,
+                'total': round(time.monotonic() - self.started, 4),
+                **self.attrs,
+                'spans': sorted(self.spans, key=lambda s: s['offset']),
+                'retries': list(self.retries),
+            }
+
+
+current_trace = contextvars.ContextVar('current_trace', default=None)
+_queue_wait = contextvars.ContextVar('queue_wait', default=None)
+
+_trace_log_path = None
+_trace_log_lock = threading.Lock()
+
+
+def configure_trace_log(path):
+    """Задает файл журнала трасс (JSON lines); пустое значение отключает журнал."""
+    global _trace_log_path
+    _trace_log_path = path or None
+
+
+def start_trace(trace_id, **attrs):
+    """Начинает трассу сообщения в текущем контексте."""
+    trace = Trace(trace_id, **attrs)
+    wait = _queue_wait.get()
+    if wait is not None:
+        _queue_wait.set(None)
+        trace.add_span('queue', trace.started - wait, wait)
+    current_trace.set(trace)
+    return trace
+
+
+def annotate(**attrs):
+    """Добавляет атрибуты (например, исход обработки) в текущую трассу."""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+
+def finish_trace(trace):
+    """Завершает трассу: учитывает исход в метриках и пишет строку в журнал трасс."""
+    current_trace.set(None)
+    record = trace.to_dict()
+    metrics.inc('s2txt_messages_total', outcome=record.get('outcome', 'unknown'))
+    metrics.observe('s2txt_stage_seconds', record['total'], stage='total')
+    if not _trace_log_path:
+        return
+    try:
+        with _trace_log_lock, open(_trace_log_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    except OSError as e:
+        logger.warning(f"Не удалось записать трассу: {e}")
+
+
+@contextmanager
+def span(stage, **attrs):
+    """Замеряет длительность этапа и добавляет его в гистограмму и текущую трассу."""
+    started = time.monotonic()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs['error'] = type(e).__name__
+        raise
+    finally:
+        record_span(stage, started, time.monotonic() - started, **attrs)
+
+
+def record_span(stage, started, duration, **attrs):
+    """Добавляет этап, длительность которого замерена отдельно, в гистограмму и текущую трассу."""
+    metrics.observe('s2txt_stage_seconds', duration, stage=stage)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add_span(stage, started, duration, **attrs)
+
+
+def record_queue_wait(wait):
+    """
+    Учитывает ожидание задачи в очереди. Трасса начинается, когда задача уже
+    взята из очереди, поэтому ожидание добавляется в трассу, которую задача
+    начнет следующей в этом же потоке, этапом 'queue' перед ее началом.
+    """
+    metrics.observe('s2txt_stage_seconds', wait, stage='queue')
+    _queue_wait.set(wait)
+
+
+def record_retry(operation, attempt, wait, error):
+    """Учитывает повторную попытку и паузу перед ней отдельно от полезной работы."""
+    metrics.inc('s2txt_retries_total', operation=operation)
+    metrics.inc('s2txt_backoff_seconds_total', wait, operation=operation)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add_retry(operation, attempt, wait, type(error).__name__)
+
+
+def start_metrics_server(host, port):
+    """Запускает HTTP сервер с метриками Prometheus на /metrics в фоновом потоке."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
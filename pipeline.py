@@ -0,0 +1,380 @@
+"""
+Конвейер обработки голосового сообщения: скачивание, нарезка,
+распознавание и ответы пользователю.
+
+Конвейер один и работает на asyncio: ffmpeg запускается через
+asyncio.create_subprocess_exec, паузы между попытками - asyncio.sleep, а
+Bot API, скачивание файла и запросы к Google идут через одну сессию aiohttp
+клиента AsyncTeleBot. В среде RUNTIME=async сообщения обрабатываются задачами
+в цикле событий бота, а пул JobScheduler (RUNTIME=threads) и процессы-обработчики
+очереди заданий (worker.py) выполняют каждое задание в своем цикле событий
+через run_voice_job. Модуль не настраивает логирование и не регистрирует
+обработчики сигналов при импорте.
+"""
+import asyncio
+import logging
+import subprocess
+import time
+
+import aiohttp
+import speech_recognition as sr
+from requests.exceptions import ReadTimeout, ConnectionError, HTTPError
+from telebot import apihelper, asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+
+from audio import SAMPLE_RATE, StreamSplitter, decode_stream, stream_chunks
+from backends import get_backend
+from cache import CachedBackend, TranscriptCache
+from jobqueue import JobQueue, LeaseLost
+from metrics import annotate, finish_trace, record_retry, record_span, span, start_trace
+from recognition import recognize_chunks
+from replies import MessageReplies, ProgressiveReplies
+from settings import (AUDIO_FORMAT, CACHE_MAX_ENTRIES, CACHE_PATH, CACHE_TTL, CHUNK_DURATION, DOWNLOAD_BLOCK_SIZE,
+                      EDIT_INTERVAL, JOB_LEASE, JOB_MAX_ATTEMPTS, JOB_QUEUE_PATH, MAX_PAUSE, MAX_QUEUE_SIZE,
+                      OUTPUT_MODE, RECOGNITION_BACKEND, RECOGNITION_BACKEND_OPTIONS, RECOGNITION_CONCURRENCY,
+                      RECOGNITION_LANGUAGE, RECOGNITION_RETRIES, SPLIT_STRATEGY, TELEGRAM_API_URL, VOSK_MODEL_PATH)
+
+logger = logging.getLogger(__name__)
+
+# Сообщения с аудио: голосовые, аудиофайлы, видеосообщения, видео и аудио или видео, отправленные файлом
+MEDIA_CONTENT_TYPES = ['voice', 'audio', 'video_note', 'video', 'document']
+
+DEFAULT_FILE_URL = 'https://api.telegram.org/file/bot{0}/{1}'
+
+# MP4/MOV/M4A: телефоны пишут индекс moov в конец файла, и из пайпа ffmpeg такой файл не прочитает
+SEEKABLE_MIME_TYPES = ('video/mp4', 'video/quicktime', 'audio/mp4', 'audio/x-m4a')
+
+# Скачивание длинного файла не ограничено по времени целиком, только ожидание соединения и данных
+DOWNLOAD_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=20)
+
+def safe_bot_operation(bot, operation, *args, **kwargs):
+    """
+    Безопасное выполнение операций с ботом с повторными попытками
+    (синхронный клиент, которым run_bot принимает обновления и отвечает на команды)
+    """
+    max_retries = 3
+    stage = f"telegram.{getattr(operation, '__name__', 'operation')}"
+    for attempt in range(max_retries):
+        try:
+            with span(stage, attempt=attempt + 1):
+                return operation(*args, **kwargs)
+        except (ReadTimeout, ConnectionError, HTTPError) as e:
+            if attempt < max_retries - 1:
+                wait_time = 2 ** attempt  # Экспоненциальная задержка
+                logger.warning(f"Ошибка {type(e).__name__} (попытка {attempt + 1}): {e}. Повторяем через {wait_time}с...")
+                record_retry(stage, attempt + 1, wait_time, e)
+                time.sleep(wait_time)
+            else:
+                logger.error(f"Не удалось выполнить операцию после {max_retries} попыток: {e}")
+                raise
+        except Exception as e:
+            logger.error(f"Неожиданная ошибка при выполнении операции: {e}")
+            raise
+
+async def safe_bot_operation_async(bot, operation, *args, **kwargs):
+    """
+    Асинхронный вариант safe_bot_operation: пауза между попытками не блокирует цикл событий
+    """
+    max_retries = 3
+    stage = f"telegram.{getattr(operation, '__name__', 'operation')}"
+    for attempt in range(max_retries):
+        try:
+            with span(stage, attempt=attempt + 1):
+                return await operation(*args, **kwargs)
+        except (asyncio_helper.RequestTimeout, asyncio_helper.ApiHTTPException,
+                aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt < max_retries - 1:
+                wait_time = 2 ** attempt  # Экспоненциальная задержка
+                logger.warning(f"Ошибка {type(e).__name__} (попытка {attempt + 1}): {e}. Повторяем через {wait_time}с...")
+                record_retry(stage, attempt + 1, wait_time, e)
+                await asyncio.sleep(wait_time)
+            else:
+                logger.error(f"Не удалось выполнить операцию после {max_retries} попыток: {e}")
+                raise
+        except Exception as e:
+            logger.error(f"Неожиданная ошибка при выполнении операции: {e}")
+            raise
+
+def is_media_message(message):
+    """Сообщение с аудио, которое можно распознать; из документов подходят только аудио и видео."""
+    if message.content_type == 'document':
+        return (message.document.mime_type or '').startswith(('audio/', 'video/'))
+    return message.content_type in MEDIA_CONTENT_TYPES
+
+def needs_seekable_input(message):
+    """Файл сообщения декодируется из временного файла, а не из пайпа (см. audio.decode_stream)."""
+    mime_type = getattr(getattr(message, message.content_type), 'mime_type', None)
+    if mime_type is None:
+        # У видеосообщений mime_type нет, а это всегда MP4
+        return message.content_type in ('video', 'video_note')
+    return mime_type in SEEKABLE_MIME_TYPES
+
+async def open_file_stream(token, file_path):
+    """
+    Открывает скачивание файла через сессию клиента Bot API, не читая его:
+    тело читается блоками (response.content.iter_chunked), поэтому длинные
+    записи не собираются в памяти целиком.
+    """
+    url = (asyncio_helper.FILE_URL or DEFAULT_FILE_URL).format(token, file_path)
+    session = await asyncio_helper.session_manager.get_session()
+    response = await session.get(url, proxy=asyncio_helper.proxy, timeout=DOWNLOAD_TIMEOUT)
+    try:
+        response.raise_for_status()
+    except aiohttp.ClientResponseError:
+        response.close()
+        raise
+    return response
+
+async def close_bot_session():
+    """Закрывает сессию aiohttp клиента AsyncTeleBot в текущем потоке."""
+    session = asyncio_helper.session_manager.session
+    if session is not None and not session.closed:
+        await session.close()
+
+def configure_bot_api():
+    """
+    Таймауты и адрес Bot API для клиентов telebot: асинхронного, которым
+    работает конвейер обработки, и синхронного, которым run_bot принимает обновления.
+    """
+    # Настройка более коротких таймаутов для раннего обнаружения проблем
+    apihelper.CONNECT_TIMEOUT = 10
+    apihelper.READ_TIMEOUT = 20
+    asyncio_helper.REQUEST_TIMEOUT = 30
+    if TELEGRAM_API_URL:
+        for helper in (apihelper, asyncio_helper):
+            helper.API_URL = TELEGRAM_API_URL.rstrip('/') + '/bot{0}/{1}'
+            helper.FILE_URL = TELEGRAM_API_URL.rstrip('/') + '/file/bot{0}/{1}'
+
+def create_cache():
+    """Кэш расшифровок с настройками из окружения."""
+    return TranscriptCache(CACHE_PATH, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+
+def create_backend():
+    """Создает кэш расшифровок и сервис распознавания с этим кэшем."""
+    transcript_cache = create_cache()
+    backend_options = {
+        'google': {'language': RECOGNITION_LANGUAGE},
+        'vosk': {'model_path': VOSK_MODEL_PATH},
+    }.get(RECOGNITION_BACKEND, {})
+    backend_options.update(RECOGNITION_BACKEND_OPTIONS)
+    backend = CachedBackend(get_backend(RECOGNITION_BACKEND, **backend_options), transcript_cache)
+    return transcript_cache, backend
+
+def create_job_queue():
+    """Очередь заданий в SQLite или None, если JOB_QUEUE_PATH не задан."""
+    if not JOB_QUEUE_PATH:
+        return None
+    return JobQueue(JOB_QUEUE_PATH, lease=JOB_LEASE, max_queue=MAX_QUEUE_SIZE, max_attempts=JOB_MAX_ATTEMPTS)
+
+def run_voice_job(token, message, backend, transcript_cache, checkpoints=None):
+    """
+    Выполняет process_voice_message в собственном цикле событий: так задание
+    обрабатывают поток пула JobScheduler и процесс-обработчик очереди. У
+    задания свой клиент AsyncTeleBot; его сессия aiohttp (она своя у каждого
+    потока) общая для Bot API, скачивания и распознавателя и закрывается в
+    конце задания.
+    """
+    async def run():
+        try:
+            return await process_voice_message(AsyncTeleBot(token), message, backend, transcript_cache,
+                                               checkpoints)
+        finally:
+            await close_bot_session()
+
+    return asyncio.run(run())
+
+async def process_voice_message(bot, message, backend, transcript_cache, checkpoints=None):
+    """
+    Обработка голосового сообщения (или другого сообщения с аудио, см.
+    MEDIA_CONTENT_TYPES); bot - клиент AsyncTeleBot. Выполняется задачей в
+    цикле событий бота или в задании пула и процесса-обработчика очереди
+    (см. run_voice_job; checkpoints - контрольные точки задания, см. jobqueue).
+    Возвращает итог обработки, как в трассе: 'ok', 'partial', 'cached',
+    'no_speech', 'error' или 'timeout'. Если попытка задания не последняя,
+    ошибки выбрасываются, и пользователь их не видит. Если аренда задания
+    потеряна, выбрасывается LeaseLost и ответы больше не отправляются.
+    """
+    media = getattr(message, message.content_type)
+    trace = start_trace(f'{message.chat.id}:{message.message_id}', chat_id=message.chat.id,
+                        content_type=message.content_type, duration=getattr(media, 'duration', None))
+    if OUTPUT_MODE == 'progressive':
+        replies = ProgressiveReplies(bot, message, safe_bot_operation_async, min_interval=EDIT_INTERVAL)
+    else:
+        replies = MessageReplies(bot, message, safe_bot_operation_async)
+    retry = checkpoints is not None and not checkpoints.final
+    try:
+        # Повторно пересланное сообщение отдаем из кэша без скачивания и распознавания
+        cache_key = f'file:{backend.name}:{media.file_unique_id}'
+        cached_parts = await asyncio.to_thread(transcript_cache.get, cache_key)
+        if cached_parts:
+            full_text = " ".join(cached_parts)
+            await replies.reply(f'📄 Полный текст:\n\n{full_text}')
+            annotate(outcome='cached')
+            return 'cached'
+
+        # Куски, распознанные до перезапуска задания, повторно не распознаются и не отправляются;
+        # возобновленное задание не повторяет и начальные сообщения
+        done = checkpoints.load() if checkpoints else {}
+        if checkpoints:
+            checkpoints.check()
+        if done:
+            annotate(resumed_chunks=len(done))
+        else:
+            await replies.reply('⌛ Подождите немного, я обрабатываю голосовое сообщение...')
+
+        # Получение файла; тело скачивается уже во время распознавания
+        with span('download', bytes=media.file_size):
+            file_info = await safe_bot_operation_async(bot, bot.get_file, media.file_id)
+            
+            if not file_info:
+                raise Exception("Не удалось получить информацию о файле")
+                
+            response = await safe_bot_operation_async(bot, open_file_stream, bot.token, file_info.file_path)
+
+        # Файл декодируется по мере скачивания, куски отправляются на распознавание по мере
+        # нарезки, а в памяти держится только окно звука, а не вся запись
+        splitter = StreamSplitter(chunk_duration=CHUNK_DURATION, strategy=SPLIT_STRATEGY, max_pause=MAX_PAUSE)
+        try:
+            seekable = needs_seekable_input(message)
+            blocks = decode_stream(response.content.iter_chunked(DOWNLOAD_BLOCK_SIZE), seekable=seekable)
+            chunks = stream_chunks(blocks, splitter, audio_format=AUDIO_FORMAT)
+            outcome = await process_recognition(replies, chunks, backend, transcript_cache, cache_key,
+                                                checkpoints, done, retry)
+        finally:
+            response.close()
+            annotate(audio_duration=round(splitter.samples / SAMPLE_RATE, 1))
+        if outcome:
+            return outcome
+        if splitter.samples:
+            await replies.reply('🔇 В сообщении не найдено речи.')
+            annotate(outcome='no_speech')
+            return 'no_speech'
+        if retry:
+            raise Exception("Не удалось декодировать аудио")
+        await replies.reply('⚠️ Не удалось обработать аудио файл.')
+        annotate(outcome='error')
+        return 'error'
+
+    except LeaseLost:
+        annotate(outcome='lease_lost')
+        raise
+    except subprocess.TimeoutExpired:
+        annotate(outcome='timeout')
+        logger.error("Таймаут при конвертации аудио")
+        if retry:
+            raise
+        await replies.reply('⚠️ Превышено время обработки файла.')
+        return 'timeout'
+    except Exception as e:
+        annotate(outcome='error')
+        logger.error(f"Ошибка при обработке голосового сообщения: {e}")
+        if retry:
+            raise
+        await replies.reply(f'⚠️ Извините, произошла ошибка при подготовке: {str(e)}')
+        return 'error'
+    finally:
+        finish_trace(trace)
+
+async def process_recognition(replies, chunks, backend, transcript_cache, cache_key=None, checkpoints=None,
+                              done=None, retry=False):
+    """
+    Выполняет параллельное распознавание речи для кусков аудио. Куски могут
+    приходить асинхронным генератором по мере скачивания и нарезки (см.
+    audio.stream_chunks). done - уже распознанные куски задания; с retry
+    ошибки распознавания выбрасываются, чтобы задание повторилось. Возвращает
+    итог обработки или None, если кусков с речью не оказалось и итог не отправлен.
+    """
+    recognized = None
+    count = 0
+    done = done or {}
+    try:
+        if not done:
+            # Число кусков потока заранее неизвестно
+            await replies.start_recognition(len(chunks) if isinstance(chunks, list) else None)
+
+        recognized_parts = []
+        complete = True
+        # Этап распознавания - это ожидание результатов кусков; отправка частей пользователю
+        # идет своими этапами telegram.* и в длительность распознавания не входит
+        started = time.monotonic()
+        replying = 0.0
+        try:
+            # Куски распознаются параллельно, результаты приходят по порядку
+            recognized = recognize_chunks(chunks, backend, max_in_flight=RECOGNITION_CONCURRENCY,
+                                          max_retries=RECOGNITION_RETRIES, done=done)
+            async for i, future in recognized:
+                count = i
+                if i in done:
+                    if done[i]:
+                        recognized_parts.append(done[i])
+                    continue
+                await asyncio.wait([future])
+                if checkpoints:
+                    # Задание забрал другой обработчик: он и отправит эту часть
+                    checkpoints.check()
+                replied = time.monotonic()
+                try:
+                    chunk_text = future.result()
+                
+                    if chunk_text.strip():
+                        recognized_parts.append(chunk_text)
+                        await replies.part(i, chunk_text)
+                    if checkpoints:
+                        checkpoints.save(i, chunk_text)
+                        
+                except sr.UnknownValueError:
+                    if checkpoints:
+                        checkpoints.save(i, '')
+                    await replies.part_failed(i, f'⚠️ Часть {i}: речь не распознана.')
+                except sr.RequestError as e:
+                    complete = False
+                    logger.error(f"Ошибка сервиса распознавания для части {i}: {e}")
+                    if not retry:
+                        await replies.part_failed(i, f'⚠️ Часть {i}: ошибка сервиса распознавания.')
+                except Exception as e:
+                    complete = False
+                    logger.error(f"Ошибка при распознавании части {i}: {e}")
+                    if not retry:
+                        await replies.part_failed(i, f'⚠️ Часть {i}: ошибка обработки.')
+                finally:
+                    replying += time.monotonic() - replied
+        finally:
+            record_span('recognition', started, time.monotonic() - started - replying,
+                        chunks=count, replies=round(replying, 4))
+
+        annotate(chunks=count)
+        if checkpoints:
+            checkpoints.check()
+        if not count:
+            return None
+        if not complete and retry:
+            # Распознанные части сохранены, повторная попытка распознает только остальные
+            raise sr.RequestError("не все части распознаны")
+
+        # Отправляем итоговый результат
+        if recognized_parts:
+            full_text = " ".join(recognized_parts)
+            await replies.finish(f'📄 Полный текст:\n\n{full_text}')
+            # В кэш попадают только расшифровки без ошибок сервиса
+            if complete and cache_key:
+                await asyncio.to_thread(transcript_cache.put, cache_key, recognized_parts)
+            outcome = 'ok' if complete else 'partial'
+        else:
+            await replies.finish('😔 К сожалению, не удалось распознать речь в аудиозаписи.')
+            outcome = 'no_speech' if complete else 'error'
+        annotate(outcome=outcome)
+        return outcome
+
+    except (subprocess.TimeoutExpired, subprocess.CalledProcessError, LeaseLost):
+        # Ошибки декодирования потока сообщает process_voice_message, как и до распознавания
+        raise
+    except Exception as e:
+        annotate(outcome='error')
+        logger.error(f"Общая ошибка при распознавании: {e}")
+        if retry:
+            raise
+        await replies.send(f'⚠️ Извините, произошла ошибка при распознавании: {str(e)}')
+        return 'error'
+    finally:
+        if recognized is not None:
+            await recognized.aclose()
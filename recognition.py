@@ -0,0 +1,177 @@
+"""
+Параллельное распознавание кусков аудио с сохранением порядка.
+
+Куски отправляются в сервис распознавания одновременно (с ограничением
+числа запросов в полете), а результаты отдаются строго в порядке кусков.
+Сервис распознавания передается параметром (см. backends), поэтому вместо
+Google можно подставить офлайн движок или локальную заглушку.
+
+Куски можно передавать генератором (см. audio.stream_chunks): распознавание начинается с первого
+куска, пока остальные еще скачиваются и декодируются. Запросы - задачи asyncio, поэтому ожидание
+сервиса и пауза перед повторной попыткой не занимают потоки.
+"""
+import asyncio
+import logging
+
+import speech_recognition as sr
+
+from metrics import record_retry, span
+
+logger = logging.getLogger(__name__)
+
+
+async def recognize_with_retry(recognize, audio_data, max_retries=3):
+    """
+    Распознает кусок (или пачку) с повторными попытками при ошибках сервиса распознавания.
+    recognize - корутина сервиса (см. backends); пауза между попытками не блокирует цикл событий.
+    max_retries - число попыток всего; меньше одной не бывает.
+    """
+    max_retries = max(1, max_retries)
+    for attempt in range(max_retries):
+        try:
+            with span('recognize', attempt=attempt + 1):
+                return await recognize(audio_data)
+        except sr.RequestError as e:
+            if attempt < max_retries - 1:
+                wait_time = 2 ** attempt  # Экспоненциальная задержка
+                logger.warning(f"Ошибка сервиса распознавания (попытка {attempt + 1}): {e}. Повторяем через {wait_time}с...")
+                record_retry('recognize', attempt + 1, wait_time, e)
+                await asyncio.sleep(wait_time)
+            else:
+                raise
+
+
+def _retrieve(future):
+    """Забирает исключение завершенного future, чтобы asyncio не писал о нем в журнал."""
+    if not future.cancelled():
+        future.exception()
+
+
+def _resolved(text):
+    """Future с ранее распознанным текстом куска; пустой текст - речь не распознана."""
+    future = asyncio.get_running_loop().create_future()
+    if text:
+        future.set_result(text)
+    else:
+        future.set_exception(sr.UnknownValueError())
+        future.add_done_callback(_retrieve)
+    return future
+
+
+def _split_batch(batch_future, futures):
+    """Передает результат пачки в future отдельных кусков."""
+    def done(batch_future):
+        error = None if batch_future.cancelled() else batch_future.exception()
+        for j, future in enumerate(futures):
+            if future.done():
+                continue
+            if batch_future.cancelled():
+                future.cancel()
+            elif error is not None:
+                future.set_exception(error)
+            elif batch_future.result()[j]:
+                future.set_result(batch_future.result()[j])
+            else:
+                future.set_exception(sr.UnknownValueError())
+
+    batch_future.add_done_callback(done)
+
+
+async def _iterate(chunks):
+    for audio_data in chunks:
+        yield audio_data
+
+
+async def recognize_chunks(chunks, backend, max_in_flight=4, max_retries=3, done=None):
+    """
+    Распознает куски параллельно и отдает пары (номер, future) в порядке кусков.
+
+    Номера начинаются с 1. Результат или исключение распознавания куска
+    получается из future после его завершения. Если сервис поддерживает
+    пачки (batch_size > 1), куски отправляются пачками. Одновременно идет не
+    больше max_in_flight запросов.
+
+    chunks - список или асинхронный итератор кусков (см. audio.stream_chunks).
+    Куски берутся в отдельной задаче по мере появления, но не дальше чем на
+    несколько пачек вперед от уже отданных, поэтому нарезка не обгоняет
+    распознавание и память не растет. Ошибка итератора выбрасывается после
+    кусков, полученных до нее. done - ранее распознанные куски {номер: текст},
+    для них сервис не вызывается.
+    """
+    batch_size = max(1, backend.batch_size)
+    done = done or {}
+    ready = asyncio.Queue()
+    slots = asyncio.Semaphore(2 * max_in_flight * batch_size)
+    in_flight = asyncio.Semaphore(max_in_flight)
+    running = set()
+
+    async def recognize(func, audio_data):
+        async with in_flight:
+            return await recognize_with_retry(func, audio_data, max_retries)
+
+    def start(func, audio_data):
+        task = asyncio.ensure_future(recognize(func, audio_data))
+        running.add(task)
+        task.add_done_callback(running.discard)
+        task.add_done_callback(_retrieve)
+        return task
+
+    def submit(batch):
+        _split_batch(start(backend.recognize_batch_async, [audio_data for audio_data, _ in batch]),
+                     [future for _, future in batch])
+
+    async def feed():
+        iterator = chunks.__aiter__() if hasattr(chunks, '__aiter__') else _iterate(chunks)
+        batch = []
+        error = None
+        try:
+            i = 0
+            while True:
+                await slots.acquire()
+                try:
+                    audio_data = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                i += 1
+                if i in done:
+                    ready.put_nowait(_resolved(done[i]))
+                elif batch_size == 1:
+                    ready.put_nowait(start(backend.recognize_async, audio_data))
+                else:
+                    future = asyncio.get_running_loop().create_future()
+                    future.add_done_callback(_retrieve)
+                    batch.append((audio_data, future))
+                    ready.put_nowait(future)
+                if len(batch) == batch_size:
+                    submit(batch)
+                    batch = []
+        except Exception as e:
+            error = e
+        finally:
+            aclose = getattr(iterator, 'aclose', None)
+            if aclose:
+                await aclose()
+        if batch:
+            submit(batch)
+        # None - признак конца кусков
+        ready.put_nowait(error)
+
+    # Задача копирует контекст, поэтому замеры нарезки и распознавания попадают в трассу сообщения
+    feeder = asyncio.ensure_future(feed())
+    try:
+        i = 0
+        while True:
+            item = await ready.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            i += 1
+            # Куски отдаются по порядку, остальные в это время продолжают распознаваться
+            yield i, item
+            slots.release()
+    finally:
+        feeder.cancel()
+        for task in list(running):
+            task.cancel()
+        await asyncio.gather(feeder, *running, return_exceptions=True)
@@ -0,0 +1,200 @@
+"""
+Ответы пользователю во время обработки голосового сообщения.
+
+MessageReplies - прежний режим: отдельное сообщение на каждый этап и на
+каждую распознанную часть. ProgressiveReplies - одно статусное сообщение,
+которое редактируется по мере распознавания; правки объединяются так,
+чтобы между ними проходило не меньше min_interval секунд.
+
+Оба режима делят длинный текст на сообщения по лимиту Telegram. Методы -
+корутины: ответы отправляет асинхронный клиент Bot API в цикле событий
+конвейера.
+"""
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длина текста одного сообщения Telegram
+MESSAGE_LIMIT = 4096
+
+
+def split_text(text, limit=MESSAGE_LIMIT):
+    """Делит текст на части не длиннее limit, по возможности по границе строки или слова."""
+    pages = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit + 1)
+        if cut <= 0:
+            cut = text.rfind(' ', 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        pages.append(text[:cut])
+        text = text[cut:].lstrip('\n ')
+    pages.append(text)
+    return pages
+
+
+class MessageReplies:
+    """Отдельное сообщение на каждый этап и каждую часть расшифровки."""
+
+    def __init__(self, bot, message, call):
+        self.bot = bot
+        self.message = message
+        self.call = call  # обертка вызовов Bot API с повторными попытками
+
+    async def reply(self, text):
+        """Ответ на исходное голосовое сообщение."""
+        for page in split_text(text):
+            await self.call(self.bot, self.bot.reply_to, self.message, page)
+
+    async def send(self, text):
+        """Сообщение в чат без привязки к исходному."""
+        for page in split_text(text):
+            await self.call(self.bot, self.bot.send_message, self.message.chat.id, page)
+
+    async def start_recognition(self, total):
+        await self.send('📝 Начинаю распознавание...')
+
+    async def part(self, i, text):
+        await self.send(f"Часть {i}: {text}")
+
+    async def part_failed(self, i, text):
+        await self.send(text)
+
+    async def finish(self, text):
+        await self.send(text)
+        await self.send('✅ Обработка завершена!')
+
+
+class ProgressiveReplies(MessageReplies):
+    """
+    Одно статусное сообщение, которое обновляется через edit_message_text.
+
+    Если текст перерастает лимит Telegram, заполненные страницы остаются
+    отдельными сообщениями, а редактируется только последняя.
+    """
+
+    def __init__(self, bot, message, call, min_interval=2.0):
+        super().__init__(bot, message, call)
+        self.min_interval = min_interval
+        # Части не ждут чужую отправку, а _send_lock сохраняет порядок вызовов Bot API
+        self._send_lock = asyncio.Lock()
+        self._sent = []          # [(message_id, текст)] по страницам; меняется только под _send_lock
+        self._text = None        # текст, который нужно показать
+        self._last_flush = 0.0
+        self._timer = None       # задача отложенной правки
+        self._parts = {}
+        self._warnings = []
+        self._total = 0
+
+    async def reply(self, text):
+        await self._show(text, force=True)
+
+    async def send(self, text):
+        await self._show(text, force=True)
+
+    async def start_recognition(self, total):
+        self._total = total
+        await self._show(self._progress_text(), force=True)
+
+    async def part(self, i, text):
+        self._parts[i] = text
+        await self._show(self._progress_text())
+
+    async def part_failed(self, i, text):
+        self._warnings.append(text)
+        await self._show(self._progress_text())
+
+    async def finish(self, text):
+        if self._warnings:
+            text = text + '\n\n' + '\n'.join(self._warnings)
+        await self._show(text, force=True)
+
+    def _progress_text(self):
+        done = len(self._parts) + len(self._warnings)
+        recognized = ' '.join(self._parts[i] for i in sorted(self._parts))
+        # Для потока кусков общее число заранее неизвестно
+        text = f'📝 Распознано частей: {done}/{self._total}' if self._total else f'📝 Распознано частей: {done}'
+        if recognized:
+            text += f'\n\n{recognized}'
+        return text
+
+    async def _show(self, text, force=False):
+        self._text = text
+        if force:
+            # Этапы и итог должны дойти до пользователя, поэтому их ошибки не скрываются
+            # и отправка ждет предыдущую, а не откладывается
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            await self._flush()
+            return
+        wait = self._last_flush + self.min_interval - time.monotonic()
+        if wait > 0:
+            self._schedule(wait)
+        elif not self._send_lock.locked():
+            await self._flush_quietly()
+        # Иначе текст уйдет следом за текущей отправкой, см. _flush
+
+    def _schedule(self, wait):
+        if not self._timer:
+            # Последняя правка не теряется: она будет отправлена по таймеру
+            self._timer = asyncio.ensure_future(self._flush_later(max(wait, 0)))
+
+    async def _flush_later(self, wait):
+        await asyncio.sleep(wait)
+        self._timer = None
+        await self._flush_quietly()
+
+    async def _flush_quietly(self):
+        try:
+            await self._flush()
+        except Exception as e:
+            logger.error(f"Не удалось обновить статусное сообщение: {e}")
+
+    async def _flush(self):
+        async with self._send_lock:
+            # Текст берется уже под _send_lock: если отправка ждала другую, уйдет самый свежий текст
+            if self._text is None:
+                return
+            pages = split_text(self._text)
+            self._text = None
+            self._last_flush = time.monotonic()
+            try:
+                await self._send(pages)
+            finally:
+                if self._text is not None:
+                    self._schedule(self._last_flush + self.min_interval - time.monotonic())
+
+    async def _send(self, pages):
+        """Приводит отправленные страницы к pages; вызывается под _send_lock."""
+        for action, i, message_id, page in self._actions(pages):
+            if action == 'edit':
+                await self.call(self.bot, self.bot.edit_message_text, page,
+                                chat_id=self.message.chat.id, message_id=message_id)
+                self._sent[i] = (message_id, page)
+            elif action == 'reply':
+                sent = await self.call(self.bot, self.bot.reply_to, self.message, page)
+                self._sent.append((sent.message_id, page))
+            elif action == 'send':
+                sent = await self.call(self.bot, self.bot.send_message, self.message.chat.id, page)
+                self._sent.append((sent.message_id, page))
+            else:
+                await self.call(self.bot, self.bot.delete_message, self.message.chat.id, message_id)
+        del self._sent[len(pages):]
+
+    def _actions(self, pages):
+        """Вызовы Bot API, которые приводят отправленные страницы к pages."""
+        actions = []
+        for i, page in enumerate(pages):
+            if i < len(self._sent):
+                message_id, sent_text = self._sent[i]
+                if page != sent_text:
+                    actions.append(('edit', i, message_id, page))
+            else:
+                actions.append(('reply' if i == 0 else 'send', i, None, page))
+        # Текст стал короче: лишние страницы больше не нужны
+        for i, (message_id, _) in enumerate(self._sent[len(pages):], len(pages)):
+            actions.append(('delete', i, message_id, None))
+        return actions
@@ -0,0 +1,199 @@
+"""
+Планировщики задач обработки с ограниченным числом одновременных задач.
+
+Очередь ограничена по размеру, задачи одного чата выполняются строго
+по очереди (FIFO), задачи разных чатов - параллельно в пределах пула.
+JobScheduler выполняет функции в пуле потоков фиксированного размера,
+AsyncJobScheduler - корутины задачами asyncio в цикле событий.
+"""
+import asyncio
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+from metrics import record_queue_wait
+
+logger = logging.getLogger(__name__)
+
+
+class JobScheduler:
+    """Пул воркеров фиксированного размера с ограниченной очередью задач."""
+
+    def __init__(self, workers=2, max_queue=20, name='worker'):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._condition = threading.Condition()
+        self._pending = deque()       # (key, func, args, время постановки) в порядке поступления
+        self._active_keys = set()     # чаты, задача которых сейчас выполняется
+        self._busy = 0
+        self._processed = 0
+        self._busy_time = 0.0         # время уже завершенных задач
+        self._running_since = {}      # воркер -> время начала его текущей задачи
+        self._started_at = time.monotonic()
+        self._running = True
+        self._start(name)
+
+    def _start(self, name):
+        """Запускает воркеры; вызывается в конце __init__."""
+        self._threads = [
+            threading.Thread(target=self._worker_loop, name=f'{name}-{i}', daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, key, func, *args):
+        """
+        Ставит задачу в очередь.
+
+        Возвращает 0, если задача сразу начнет выполняться, иначе ее позицию
+        в очереди. Если очередь заполнена, выбрасывает queue.Full.
+        """
+        with self._condition:
+            if len(self._pending) >= self.max_queue:
+                raise queue.Full
+            ahead_keys = [job[0] for job in self._pending]
+            runnable_ahead = len({k for k in ahead_keys if k not in self._active_keys})
+            idle = self.workers - self._busy
+            self._pending.append((key, func, args, time.monotonic()))
+            if key not in self._active_keys and key not in ahead_keys and runnable_ahead < idle:
+                position = 0
+            else:
+                position = len(self._pending)
+            self._condition.notify()
+            self._dispatch_locked()
+            return position
+
+    def _dispatch_locked(self):
+        """Воркеры-потоки сами забирают задачи из очереди; см. AsyncJobScheduler."""
+
+    def stats(self):
+        """Текущее состояние пула для мониторинга."""
+        with self._condition:
+            now = time.monotonic()
+            uptime = now - self._started_at
+            # Длинная задача учитывается в загрузке, пока выполняется, а не только после завершения
+            busy_time = self._busy_time + sum(now - started for started in self._running_since.values())
+            return {
+                'workers': self.workers,
+                'busy': self._busy,
+                'queued': len(self._pending),
+                'max_queue': self.max_queue,
+                'processed': self._processed,
+                'utilisation': busy_time / (uptime * self.workers) if uptime else 0.0,
+            }
+
+    def stop(self, timeout=None):
+        """Останавливает воркеры; задачи, оставшиеся в очереди, отбрасываются."""
+        with self._condition:
+            self._running = False
+            dropped = len(self._pending)
+            self._pending.clear()
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        if dropped:
+            logger.warning(f"Планировщик остановлен, отброшено задач: {dropped}")
+
+    def _next_job(self):
+        """Первая задача, чат которой сейчас не обрабатывается."""
+        for job in self._pending:
+            if job[0] not in self._active_keys:
+                self._pending.remove(job)
+                return job
+        return None
+
+    def _take_locked(self, worker):
+        """Забирает задачу для воркера worker и отмечает ее чат занятым; None - выполнять нечего."""
+        job = self._next_job()
+        if job is not None:
+            self._active_keys.add(job[0])
+            self._busy += 1
+            self._running_since[worker] = time.monotonic()
+        return job
+
+    def _release_locked(self, worker, key):
+        """Учитывает завершение задачи воркера worker."""
+        self._active_keys.discard(key)
+        self._busy -= 1
+        self._processed += 1
+        self._busy_time += time.monotonic() - self._running_since.pop(worker)
+        # Освободившийся чат может разблокировать ожидающие задачи
+        self._condition.notify_all()
+        self._dispatch_locked()
+
+    def _worker_loop(self):
+        worker = threading.get_ident()
+        while True:
+            with self._condition:
+                job = None
+                while self._running and job is None:
+                    job = self._take_locked(worker)
+                    if job is None:
+                        self._condition.wait()
+                if not self._running:
+                    return
+                key, func, args, queued_at = job
+                started = self._running_since[worker]
+
+            record_queue_wait(started - queued_at)
+            try:
+                func(*args)
+            except Exception as e:
+                logger.error(f"Необработанная ошибка в задаче: {e}")
+            finally:
+                with self._condition:
+                    self._release_locked(worker, key)
+
+
+class AsyncJobScheduler(JobScheduler):
+    """
+    Тот же планировщик для среды asyncio: задачи - корутинные функции, и
+    каждая выполняется отдельной задачей asyncio, пока их не больше workers.
+    Ожидание сети и ffmpeg не занимает потоки, поэтому workers может быть
+    гораздо больше, чем у пула потоков. Создается и используется в цикле
+    событий; stats() можно вызывать из любого потока.
+    """
+
+    def _start(self, name):
+        self._loop = asyncio.get_running_loop()
+        self._tasks = set()
+
+    def _dispatch_locked(self):
+        # Задачи запускаются сразу, пока есть свободные места и чаты, которые не обрабатываются
+        while self._running and self._busy < self.workers:
+            worker = object()
+            job = self._take_locked(worker)
+            if job is None:
+                return
+            task = asyncio.ensure_future(self._run(worker, job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, worker, job):
+        key, func, args, queued_at = job
+        record_queue_wait(self._running_since[worker] - queued_at)
+        try:
+            await func(*args)
+        except Exception as e:
+            logger.error(f"Необработанная ошибка в задаче: {e}")
+        finally:
+            with self._condition:
+                self._release_locked(worker, key)
+
+    async def stop(self, timeout=None):
+        """Останавливает планировщик: очередь отбрасывается, выполняющиеся задачи отменяются через timeout."""
+        with self._condition:
+            self._running = False
+            dropped = len(self._pending)
+            self._pending.clear()
+        if self._tasks:
+            _, running = await asyncio.wait(list(self._tasks), timeout=timeout)
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.wait(running)
+        if dropped:
+            logger.warning(f"Планировщик остановлен, отброшено задач: {dropped}")
@@ -0,0 +1,88 @@
+"""
+Настройки бота и процессов-обработчиков из переменных окружения.
+
+Модуль только читает настройки и ничего не запускает, поэтому его
+импортируют и main.py, и worker.py, и тесты.
+"""
+import json
+import os
+import secrets
+from urllib.parse import urlsplit
+
+# Получение токена и ID пользователя из переменных окружения
+TOKEN = os.getenv('TOKEN')
+ALLOWED_USER_ID = int(os.getenv('ALLOWED_USER_ID')) if os.getenv('ALLOWED_USER_ID') else None
+
+# Если переменные окружения не установлены, пытаемся импортировать из конфига;
+# без токена main.py и worker.py завершаются при запуске
+if not TOKEN or not ALLOWED_USER_ID:
+    try:
+        from config import TOKEN, ALLOWED_USER_ID
+        ALLOWED_USER_ID = int(ALLOWED_USER_ID)
+    except ImportError:
+        pass
+
+# Адрес Bot API (например, локального telegram-bot-api или тестового сервера); по умолчанию api.telegram.org
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+
+# Размер пула обработчиков и максимальная длина очереди голосовых сообщений
+MAX_WORKERS = int(os.getenv('MAX_WORKERS', 2))
+MAX_QUEUE_SIZE = int(os.getenv('MAX_QUEUE_SIZE', 20))
+
+# Сервис распознавания: 'google', 'vosk' (офлайн, нужна модель) или 'fake' (заглушка для тестов)
+RECOGNITION_BACKEND = os.getenv('RECOGNITION_BACKEND', 'google')
+RECOGNITION_LANGUAGE = os.getenv('RECOGNITION_LANGUAGE', 'ru-RU')
+VOSK_MODEL_PATH = os.getenv('VOSK_MODEL_PATH', 'model')
+# Дополнительные параметры сервиса распознавания в JSON, например {"latency": 0.5} для 'fake'
+RECOGNITION_BACKEND_OPTIONS = json.loads(os.getenv('RECOGNITION_BACKEND_OPTIONS', '{}'))
+
+# Количество одновременных запросов к сервису распознавания и число попыток на кусок
+RECOGNITION_CONCURRENCY = int(os.getenv('RECOGNITION_CONCURRENCY', 4))
+RECOGNITION_RETRIES = int(os.getenv('RECOGNITION_RETRIES', 3))
+
+# Способ нарезки аудио: 'vad' - по паузам с пропуском тишины, 'fixed' - равными кусками
+SPLIT_STRATEGY = os.getenv('SPLIT_STRATEGY', 'vad')
+CHUNK_DURATION = int(os.getenv('CHUNK_DURATION', 30))
+# Паузы длиннее MAX_PAUSE секунд нарезка 'vad' вырезает из куска, склеивая фразы встык
+MAX_PAUSE = float(os.getenv('MAX_PAUSE', 2.0))
+
+# Формат кусков для распознавателя: 'flac' - кодируются ffmpeg заранее, 'pcm' - сырые 16 кГц
+AUDIO_FORMAT = os.getenv('AUDIO_FORMAT', 'flac')
+
+# Размер блока при потоковом скачивании файла, байт: файл не собирается в памяти целиком
+DOWNLOAD_BLOCK_SIZE = int(os.getenv('DOWNLOAD_BLOCK_SIZE', 64 * 1024))
+
+# Кэш расшифровок: файл SQLite (пустое значение - только в памяти), лимит записей и срок хранения
+CACHE_PATH = os.getenv('CACHE_PATH', 'transcripts.sqlite3')
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 10000))
+CACHE_TTL = int(os.getenv('CACHE_TTL', 30 * 24 * 3600))
+
+# Вывод результата: 'messages' - сообщение на каждую часть, 'progressive' - одно обновляемое сообщение
+OUTPUT_MODE = os.getenv('OUTPUT_MODE', 'messages')
+EDIT_INTERVAL = float(os.getenv('EDIT_INTERVAL', 2))
+
+# Метрики Prometheus (порт не задан - сервер не запускается) и журнал трасс по сообщениям
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT')) if os.getenv('METRICS_PORT') else None
+# Процесс-обработчик i из worker.py отдает свои метрики на порту WORKER_METRICS_PORT + i
+WORKER_METRICS_PORT = (int(os.getenv('WORKER_METRICS_PORT')) if os.getenv('WORKER_METRICS_PORT')
+                       else METRICS_PORT + 1 if METRICS_PORT else None)
+TRACE_LOG = os.getenv('TRACE_LOG', 'traces.jsonl')
+
+# Среда выполнения: 'threads' - пул потоков, 'async' - asyncio с одной общей сессией HTTP
+RUNTIME = os.getenv('RUNTIME', 'threads')
+
+# Долговременная очередь заданий в SQLite: если задан файл, бот только ставит сообщения в очередь,
+# а обрабатывают их процессы worker.py; задания переживают перезапуски бота и обработчиков
+JOB_QUEUE_PATH = os.getenv('JOB_QUEUE_PATH')
+JOB_LEASE = int(os.getenv('JOB_LEASE', 60))  # аренда задания, секунд; продлевается, пока обработчик жив
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', os.cpu_count() or 1))
+
+# Вебхук: если задан публичный адрес, обновления принимает локальный HTTP сервер вместо long polling
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+WEBHOOK_PATH = (urlsplit(WEBHOOK_URL).path or '/') if WEBHOOK_URL else '/'
+# Секрет для заголовка X-Telegram-Bot-Api-Secret-Token; если не задан, генерируется при запуске
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
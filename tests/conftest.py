@@ -0,0 +1,20 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# Модули бота лежат в корне репозитория и импортируются по имени, как в main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio import SAMPLE_RATE, to_audio_data  # noqa: E402
+
+
+@pytest.fixture
+def chunk():
+    """Фабрика кусков: шум со своим seed, чтобы у разных кусков был разный текст."""
+    def make(seed, seconds=1.0):
+        samples = np.random.default_rng(seed).normal(0, 3000, int(seconds * SAMPLE_RATE)).astype(np.int16)
+        return to_audio_data(samples)
+
+    return make
@@ -0,0 +1,290 @@
+import asyncio
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import pytest
+
+import audio
+from audio import (SAMPLE_RATE, SAMPLE_WIDTH, StreamSplitter, decode_audio, decode_stream, encode_flac,
+                   find_speech_segments, fixed_segments, pack_segments, split_audio)
+from benchmarks.synthetic import synthetic_speech, synthetic_voice
+
+
+def phrases(*parts, sample_rate=SAMPLE_RATE, seed=0):
+    """PCM из чередующихся фраз и пауз: parts - длительности (речь, пауза, речь, ...), секунд."""
+    rng = np.random.default_rng(seed)
+    pieces = []
+    for i, duration in enumerate(parts):
+        level = 3000 if i % 2 == 0 else 30
+        pieces.append(rng.normal(0, level, int(duration * sample_rate)))
+    return np.clip(np.concatenate(pieces), -32768, 32767).astype(np.int16)
+
+
+def seconds(segments):
+    return [(round(start / SAMPLE_RATE, 1), round(end / SAMPLE_RATE, 1)) for start, end in segments]
+
+
+def test_silence_has_no_segments():
+    assert find_speech_segments(np.zeros(5 * SAMPLE_RATE, dtype=np.int16)) == []
+
+
+def test_edges_are_trimmed():
+    samples = phrases(0, 2, 3, 2)
+    [(start, end)] = find_speech_segments(samples)
+    assert 1.7 <= start / SAMPLE_RATE <= 2.0
+    assert 5.0 <= end / SAMPLE_RATE <= 5.3
+
+
+def test_phrases_are_found_between_pauses():
+    samples = phrases(3, 0.8, 3, 4, 3)
+    assert len(find_speech_segments(samples, max_duration=30)) == 3
+
+
+def test_short_pauses_stay_in_chunk():
+    samples = phrases(3, 0.8, 3, 1.2, 3)
+    [chunk] = pack_segments(find_speech_segments(samples), max_duration=30, max_pause=2)
+    assert len(chunk) == 1
+
+
+def test_long_pause_is_cut_out_of_chunk():
+    samples = phrases(3, 0.8, 3, 4, 3)
+    [chunk] = pack_segments(find_speech_segments(samples), max_duration=30, max_pause=2)
+    # Фразы в одном куске, а длинная пауза между участками не попадает в кусок
+    assert len(chunk) == 2
+    assert chunk[0][1] / SAMPLE_RATE < 7.2
+    assert chunk[1][0] / SAMPLE_RATE > 10.6
+
+    [audio_data] = asyncio.run(split_audio(samples, chunk_duration=30, max_pause=2))
+    # От паузы в 4 с остаются только края фраз
+    assert 9.5 <= len(audio_data.frame_data) / SAMPLE_WIDTH / SAMPLE_RATE <= 10.4
+
+
+def test_pack_segments_fills_chunks_up_to_max_duration():
+    s = SAMPLE_RATE
+    segments = [(0, 10 * s), (11 * s, 15 * s), (20 * s, 35 * s), (60 * s, 70 * s), (80 * s, 81 * s)]
+    assert pack_segments(segments, max_duration=30, max_pause=2) == [
+        [(0, 15 * s), (20 * s, 35 * s)],
+        [(60 * s, 70 * s), (80 * s, 81 * s)],
+    ]
+
+
+def test_vad_sends_fewer_chunks_than_fixed():
+    samples = synthetic_speech(300, seed=0)
+    vad = asyncio.run(split_audio(samples, chunk_duration=30, strategy='vad'))
+    fixed = asyncio.run(split_audio(samples, chunk_duration=30, strategy='fixed'))
+    assert len(vad) < len(fixed)
+    assert all(len(chunk.frame_data) <= 30 * SAMPLE_RATE * SAMPLE_WIDTH for chunk in vad)
+
+
+def test_chunks_do_not_exceed_max_duration():
+    samples = phrases(25, 0.5, 25, 0.5, 25)
+    segments = find_speech_segments(samples, max_duration=30)
+    assert len(segments) >= 3
+    assert all(end - start <= 30 * SAMPLE_RATE for start, end in segments)
+
+
+def test_fixed_segments_cover_the_whole_record():
+    samples = np.zeros(65 * SAMPLE_RATE, dtype=np.int16)
+    assert seconds(fixed_segments(samples, max_duration=30)) == [(0, 30), (30, 60), (60, 65)]
+
+
+def stream_segments(samples, splitter, block=SAMPLE_RATE):
+    """
+    Прогоняет запись через StreamSplitter блоками; возвращает куски
+    (списки участков в отсчетах записи) и пик буфера.
+    """
+    segments = []
+    peak = 0
+
+    def collect(buffer, chunks):
+        # Буфер, который вернул feed() или flush(), заканчивается на последнем полученном отсчете
+        offset = splitter.samples - len(buffer)
+        segments.extend([(offset + start, offset + end) for start, end in chunk] for chunk in chunks)
+
+    for i in range(0, len(samples), block):
+        collect(*splitter.feed(samples[i:i + block]))
+        peak = max(peak, len(splitter._buffer))
+    collect(*splitter.flush())
+    return segments, peak
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_stream_splitter_matches_whole_buffer(seed):
+    samples = synthetic_speech(300, seed=seed)
+    whole = pack_segments(find_speech_segments(samples, max_duration=30), max_duration=30)
+    streamed, _ = stream_segments(samples, StreamSplitter(chunk_duration=30))
+
+    def length(chunk):
+        return sum(end - start for start, end in chunk)
+
+    assert abs(len(streamed) - len(whole)) <= 1
+    speech = sum(map(length, whole))
+    assert abs(sum(map(length, streamed)) - speech) <= 0.02 * speech
+    assert all(length(chunk) <= 30 * SAMPLE_RATE for chunk in streamed)
+    ranges = [segment for chunk in streamed for segment in chunk]
+    assert all(a[1] <= b[0] for a, b in zip(ranges, ranges[1:]))
+
+
+def test_stream_splitter_releases_phrase_before_long_silence():
+    splitter = StreamSplitter(chunk_duration=30)
+    samples = phrases(3, 600)
+    streamed, peak = stream_segments(samples, splitter)
+    assert len(streamed) == 1
+    # Буфер не растет с длиной тишины: фраза отдается, а в буфере остается только хвост
+    assert peak <= splitter._window + SAMPLE_RATE
+
+
+def test_stream_splitter_fixed_strategy_covers_record():
+    samples = phrases(100, 5)
+    streamed, _ = stream_segments(samples, StreamSplitter(chunk_duration=30, strategy='fixed'))
+    assert [seconds(chunk) for chunk in streamed] == [[(0, 30)], [(30, 60)], [(60, 90)], [(90, 105)]]
+
+
+ffmpeg = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='нужен ffmpeg')
+
+
+async def voice_blocks(data, stall_after=None, block_size=4096, delay=0):
+    """Файл блоками, как при скачивании; stall_after - после скольких байт скачивание зависает."""
+    for i in range(0, len(data), block_size):
+        yield data[i:i + block_size]
+        if stall_after is not None and i >= stall_after:
+            await asyncio.sleep(30)
+        await asyncio.sleep(delay)
+
+
+def decode(blocks, **kwargs):
+    """Все блоки PCM из decode_stream."""
+    async def collect():
+        return [block async for block in decode_stream(blocks, **kwargs)]
+
+    return asyncio.run(collect())
+
+
+@ffmpeg
+def test_decode_stream_matches_decode_audio():
+    data = synthetic_voice(5)
+    streamed = np.concatenate(decode(voice_blocks(data)))
+    assert np.array_equal(streamed, decode_audio(data))
+
+
+@ffmpeg
+def test_decode_stream_does_not_block_event_loop():
+    data = synthetic_voice(5)
+    ticks = 0
+
+    async def scenario():
+        nonlocal ticks
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.ensure_future(tick())
+        samples = sum([len(block) async for block in decode_stream(voice_blocks(data, delay=0.01))])
+        ticker.cancel()
+        return samples
+
+    started = time.monotonic()
+    assert asyncio.run(scenario()) == 5 * SAMPLE_RATE
+    # Пока ждали сеть и ffmpeg, другие задачи цикла событий выполнялись
+    assert ticks >= (time.monotonic() - started) / 0.01 / 2
+
+
+@pytest.fixture(scope='module')
+def moov_at_end(tmp_path_factory):
+    """M4A, как с телефона: индекс moov записан после данных, в конце файла."""
+    path = tmp_path_factory.mktemp('media') / 'voice.m4a'
+    subprocess.run(['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', 'sine=frequency=440:duration=30',
+                    '-c:a', 'aac', '-b:a', '128k', str(path)], check=True)
+    data = path.read_bytes()
+    assert data.find(b'moov') > data.find(b'mdat') > 0
+    return data
+
+
+@ffmpeg
+def test_moov_at_end_is_not_decoded_from_pipe(moov_at_end):
+    try:
+        samples = sum(len(block) for block in decode(voice_blocks(moov_at_end)))
+    except subprocess.CalledProcessError:
+        samples = 0
+    assert samples == 0
+
+
+@ffmpeg
+def test_seekable_decode_reads_moov_at_end(moov_at_end):
+    samples = sum(len(block) for block in decode(voice_blocks(moov_at_end, block_size=65536), seekable=True))
+    assert abs(samples - 30 * SAMPLE_RATE) < 0.1 * SAMPLE_RATE
+
+
+@ffmpeg
+def test_seekable_decode_removes_temporary_file(moov_at_end, tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+
+    async def scenario():
+        decoded = decode_stream(voice_blocks(moov_at_end, block_size=65536), seekable=True)
+        await decoded.__anext__()
+        assert len(list(tmp_path.iterdir())) == 1
+        # Потребитель остановился раньше конца файла
+        await decoded.aclose()
+
+    asyncio.run(scenario())
+    assert list(tmp_path.iterdir()) == []
+
+
+@ffmpeg
+def test_decode_stream_times_out_on_stalled_download():
+    data = synthetic_voice(5)
+    started = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        decode(voice_blocks(data, stall_after=8192), timeout=1)
+    assert time.monotonic() - started < 5
+
+
+@ffmpeg
+def test_decode_stream_waits_for_slow_consumer():
+    data = synthetic_voice(3)
+
+    async def scenario():
+        samples = 0
+        # Пока потребитель занят, срок ожидания ffmpeg не идет
+        async for block in decode_stream(voice_blocks(data), timeout=0.5):
+            await asyncio.sleep(0.7)
+            samples += len(block)
+        return samples
+
+    assert asyncio.run(scenario()) == 3 * SAMPLE_RATE
+
+
+@ffmpeg
+def test_encode_flac_encodes_each_segment():
+    samples = phrases(2, 1, 2)
+    segments = [(0, 2 * SAMPLE_RATE), (3 * SAMPLE_RATE, 5 * SAMPLE_RATE)]
+    flac_chunks = asyncio.run(encode_flac(samples, segments))
+    assert len(flac_chunks) == 2
+    assert all(data.startswith(b'fLaC') for data in flac_chunks)
+
+
+@ffmpeg
+def test_encode_flac_timeout_releases_process(monkeypatch):
+    processes = []
+    create_subprocess_exec = asyncio.create_subprocess_exec
+
+    async def record(*args, **kwargs):
+        process = await create_subprocess_exec(*args, **kwargs)
+        processes.append(process)
+        return process
+
+    monkeypatch.setattr(audio.asyncio, 'create_subprocess_exec', record)
+    samples = phrases(20)
+    segments = [(i * SAMPLE_RATE, (i + 1) * SAMPLE_RATE) for i in range(20)]
+    with pytest.raises(subprocess.TimeoutExpired):
+        asyncio.run(encode_flac(samples, segments, timeout=1e-6))
+
+    [process] = processes
+    # Процесс остановлен и дождан
+    assert process.returncode is not None
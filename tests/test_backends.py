@@ -0,0 +1,168 @@
+import asyncio
+
+import numpy as np
+import pytest
+import speech_recognition as sr
+from aiohttp import web
+
+import backends
+from audio import SAMPLE_RATE, SAMPLE_WIDTH, FlacAudioData, to_audio_data
+from backends import FakeBackend, GoogleBackend, get_backend
+from cache import CachedBackend, TranscriptCache
+from pipeline import close_bot_session
+from recognition import recognize_chunks
+
+
+def silence(seconds=1.0):
+    return to_audio_data(np.zeros(int(seconds * SAMPLE_RATE), dtype=np.int16))
+
+
+@pytest.fixture(autouse=True)
+def fresh_backends(monkeypatch):
+    monkeypatch.setattr(backends, '_backends', {})
+
+
+def test_get_backend_returns_one_instance_per_process():
+    backend = get_backend('fake', latency=0.1)
+    assert isinstance(backend, FakeBackend)
+    assert backend.latency == 0.1
+    assert get_backend('fake') is backend
+
+
+def test_get_backend_rejects_unknown_name():
+    with pytest.raises(ValueError):
+        get_backend('whisper')
+
+
+def test_fake_backend_is_deterministic(chunk):
+    assert FakeBackend().recognize(chunk(1)) == FakeBackend().recognize(chunk(1))
+    assert FakeBackend().recognize(chunk(1)) != FakeBackend().recognize(chunk(2))
+    with pytest.raises(sr.UnknownValueError):
+        FakeBackend().recognize(silence())
+
+
+def test_cached_backend_recognizes_each_chunk_once(chunk):
+    fake = FakeBackend()
+    backend = CachedBackend(fake, TranscriptCache())
+    text = backend.recognize(chunk(1))
+    assert backend.recognize(chunk(1)) == text
+    assert fake.calls == 1
+
+
+def test_cached_backend_remembers_unrecognized_speech():
+    fake = FakeBackend()
+    backend = CachedBackend(fake, TranscriptCache())
+    for _ in range(2):
+        with pytest.raises(sr.UnknownValueError):
+            backend.recognize(silence())
+    assert fake.calls == 1
+
+
+def test_cached_backend_does_not_cache_service_errors(chunk):
+    fake = FakeBackend(error_rate=1.0)
+    backend = CachedBackend(fake, TranscriptCache())
+    for _ in range(2):
+        with pytest.raises(sr.RequestError):
+            backend.recognize(chunk(1))
+    assert fake.calls == 2
+
+
+def test_cached_backend_sends_only_missing_chunks_in_batch(chunk):
+    fake = FakeBackend(batch_size=4)
+    backend = CachedBackend(fake, TranscriptCache())
+    first = backend.recognize_batch([chunk(1), chunk(2)])
+    texts = backend.recognize_batch([chunk(1), chunk(3), chunk(2), silence()])
+    assert texts[0] == first[0] and texts[2] == first[1]
+    assert texts[3] == ''
+    assert fake.calls == 2
+
+
+def test_cache_survives_restart(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    cache = TranscriptCache(path)
+    cache.put('file:fake:1', ['раз', 'два'])
+    cache.close()
+    assert TranscriptCache(path).get('file:fake:1') == ['раз', 'два']
+
+
+def test_cached_backend_async_batch_uses_cache(chunk):
+    fake = FakeBackend(batch_size=4)
+    backend = CachedBackend(fake, TranscriptCache())
+    first = backend.recognize_batch([chunk(1), chunk(2)])
+    texts = asyncio.run(backend.recognize_batch_async([chunk(1), chunk(3), chunk(2), silence()]))
+    assert texts[0] == first[0] and texts[2] == first[1]
+    assert texts[3] == ''
+    assert fake.calls == 2
+
+
+def test_chunks_are_sent_in_batches(chunk):
+    backend = FakeBackend(batch_size=3)
+    chunks = [chunk(seed) for seed in range(7)] + [silence()]
+    expected = [FakeBackend().recognize(audio_data) for audio_data in chunks[:7]]
+
+    async def collect():
+        texts = []
+        async for i, future in recognize_chunks(chunks, backend, max_in_flight=2):
+            try:
+                texts.append(await future)
+            except sr.UnknownValueError:
+                texts.append('')
+        return texts
+
+    assert asyncio.run(collect()) == expected + ['']
+    # 8 кусков пачками по 3
+    assert backend.calls == 3
+
+
+GOOGLE_RESPONSE = (
+    '{"result":[]}\n'
+    '{"result":[{"alternative":[{"transcript":"привет мир","confidence":0.9}],"final":true}],"result_index":0}\n'
+)
+
+
+def recognize_google(status, body, audio_data, monkeypatch):
+    """GoogleBackend.recognize_async против локального сервера; возвращает результат и полученные запросы."""
+    requests = []
+
+    async def handle(request):
+        requests.append((request.query, request.headers['Content-Type'], await request.read()))
+        return web.Response(status=status, text=body)
+
+    async def run():
+        app = web.Application()
+        app.router.add_post('/speech-api/v2/recognize', handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', 0).start()
+        port = runner.addresses[0][1]
+        monkeypatch.setattr(backends, 'ENDPOINT', f'http://127.0.0.1:{port}/speech-api/v2/recognize')
+        try:
+            return await GoogleBackend(language='ru-RU').recognize_async(audio_data)
+        finally:
+            await close_bot_session()
+            await runner.cleanup()
+
+    return asyncio.run(run()), requests
+
+
+@pytest.mark.skipif(backends.create_request_builder is None, reason='нужен speech_recognition с recognizers.google')
+def test_google_backend_sends_prepared_flac(monkeypatch):
+    audio_data = FlacAudioData(b'\0' * SAMPLE_WIDTH * 160, SAMPLE_RATE, SAMPLE_WIDTH, b'fLaC-prepared')
+    text, requests = recognize_google(200, GOOGLE_RESPONSE, audio_data, monkeypatch)
+    assert text == 'привет мир'
+    [(query, content_type, body)] = requests
+    assert query['lang'] == 'ru-RU'
+    assert content_type == f'audio/x-flac; rate={SAMPLE_RATE}'
+    # Заранее закодированный FLAC уходит как есть
+    assert body == b'fLaC-prepared'
+
+
+@pytest.mark.skipif(backends.create_request_builder is None, reason='нужен speech_recognition с recognizers.google')
+@pytest.mark.parametrize('status, body, error', [
+    (500, '', sr.RequestError),
+    (200, '{"result":[]}\n', sr.UnknownValueError),
+])
+def test_google_backend_errors(monkeypatch, status, body, error):
+    audio_data = FlacAudioData(b'\0' * SAMPLE_WIDTH * 160, SAMPLE_RATE, SAMPLE_WIDTH, b'fLaC')
+    with pytest.raises(error):
+        recognize_google(status, body, audio_data, monkeypatch)
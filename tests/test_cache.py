@@ -0,0 +1,99 @@
+import pytest
+
+import cache
+from cache import TranscriptCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'cache.sqlite3')
+
+
+def on_disk(path, key, **kwargs):
+    """Значение из файла кэша, минуя память этого экземпляра."""
+    other = TranscriptCache(path, **kwargs)
+    try:
+        return other.get(key)
+    finally:
+        other.close()
+
+
+def test_expired_entries_are_not_returned(clock, path):
+    transcript_cache = TranscriptCache(path, ttl=100)
+    transcript_cache.put('a', 'текст')
+    assert transcript_cache.get('a') == 'текст'
+
+    clock.now += 100
+    assert transcript_cache.get('a') is None
+    transcript_cache.close()
+    assert on_disk(path, 'a', ttl=100) is None
+
+
+def test_expired_entries_are_deleted_on_eviction(clock, path, monkeypatch):
+    monkeypatch.setattr(cache, 'EVICT_INTERVAL', 1)
+    transcript_cache = TranscriptCache(path, ttl=100)
+    transcript_cache.put('old', 'старый')
+    clock.now += 100
+    transcript_cache.put('new', 'новый')
+    assert transcript_cache.stats()['disk_entries'] == 1
+    transcript_cache.close()
+
+
+def test_least_recently_used_entries_are_evicted(clock, path, monkeypatch):
+    monkeypatch.setattr(cache, 'EVICT_INTERVAL', 1)
+    transcript_cache = TranscriptCache(path, max_entries=3)
+    for key in 'abc':
+        transcript_cache.put(key, key)
+    # Попадание в памяти тоже считается обращением к записи на диске
+    assert transcript_cache.get('a') == 'a'
+    transcript_cache.put('d', 'd')
+    transcript_cache.close()
+
+    assert on_disk(path, 'b') is None
+    assert [on_disk(path, key) for key in 'acd'] == ['a', 'c', 'd']
+
+
+def test_eviction_runs_every_interval(clock, path, monkeypatch):
+    monkeypatch.setattr(cache, 'EVICT_INTERVAL', 5)
+    transcript_cache = TranscriptCache(path, max_entries=2)
+    for i in range(4):
+        transcript_cache.put(str(i), i)
+    # Лишние записи живут до очередного вытеснения
+    assert transcript_cache.stats()['disk_entries'] == 4
+    transcript_cache.put('4', 4)
+    assert transcript_cache.stats()['disk_entries'] == 2
+    transcript_cache.close()
+    assert [on_disk(path, key) for key in '34'] == [3, 4]
+
+
+def test_memory_hits_are_written_in_batches(clock, path, monkeypatch):
+    monkeypatch.setattr(cache, 'TOUCH_BATCH', 2)
+    transcript_cache = TranscriptCache(path)
+    transcript_cache.put('a', 'a')
+    transcript_cache.put('b', 'b')
+
+    def accessed(key):
+        return transcript_cache._db.execute("SELECT accessed FROM transcripts WHERE key = ?", (key,)).fetchone()[0]
+
+    before = accessed('a')
+    transcript_cache.get('a')
+    assert accessed('a') == before
+    transcript_cache.get('b')
+    assert accessed('a') > before
+    transcript_cache.close()
@@ -0,0 +1,172 @@
+import queue
+
+import pytest
+
+import jobqueue
+from jobqueue import JobQueue
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(jobqueue.time, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def jobs(tmp_path, clock):
+    jobs = JobQueue(str(tmp_path / 'jobs.sqlite3'), lease=60, max_queue=10, max_attempts=3)
+    yield jobs
+    jobs.close()
+
+
+def idle_workers(jobs, *workers):
+    """Обработчики отмечаются живыми, обращаясь к пустой очереди."""
+    for worker in workers:
+        assert jobs.claim(worker) is None
+
+
+def test_submit_accounts_for_idle_workers(jobs):
+    idle_workers(jobs, 'w1', 'w2')
+    # Два свободных обработчика сразу возьмут два задания разных чатов
+    assert jobs.submit('a', {}) == 0
+    assert jobs.submit('b', {}) == 0
+    assert jobs.submit('c', {}) == 3
+    # Задание чата, у которого уже есть задание в очереди, ждет его
+    assert jobs.submit('a', {}) == 4
+
+
+def test_submit_waits_for_busy_chat(jobs):
+    idle_workers(jobs, 'w1', 'w2')
+    jobs.submit('a', {})
+    assert jobs.claim('w1')[0] == 1
+    # Свободный обработчик есть, но чат 'a' занят
+    assert jobs.submit('a', {}) == 1
+    assert jobs.submit('b', {}) == 0
+
+
+def test_submit_without_workers_reports_position(jobs):
+    assert jobs.submit('a', {}) == 1
+
+
+def test_full_queue_raises(jobs):
+    for i in range(10):
+        jobs.submit(i, {})
+    with pytest.raises(queue.Full):
+        jobs.submit('a', {})
+
+
+def test_jobs_of_one_chat_are_claimed_in_order(jobs):
+    jobs.submit('a', {'n': 1})
+    jobs.submit('a', {'n': 2})
+    jobs.submit('b', {'n': 3})
+
+    assert jobs.claim('w1')[1] == {'n': 1}
+    # Второе сообщение чата 'a' ждет первое, а чат 'b' обрабатывается параллельно
+    assert jobs.claim('w2')[1] == {'n': 3}
+    assert jobs.claim('w3') is None
+    jobs.complete(1, 'w1')
+    assert jobs.claim('w3')[1] == {'n': 2}
+
+
+def test_claim_returns_attempt_and_queue_time(jobs, clock):
+    jobs.submit('a', {})
+    clock.now += 5
+    assert jobs.claim('w1') == (1, {}, 1, 1000.0)
+
+
+def test_expired_lease_is_reclaimed(jobs, clock):
+    jobs.submit('a', {})
+    assert jobs.claim('w1')[2] == 1
+    assert jobs.heartbeat(1, 'w1')
+
+    clock.now += jobs.lease + 1
+    job_id, _, attempt, queued_at = jobs.claim('w2')
+    assert (job_id, attempt) == (1, 2)
+    # Ожидание повторной попытки считается с истечения аренды
+    assert queued_at == 1000.0 + jobs.lease
+    assert not jobs.heartbeat(1, 'w1')
+    assert jobs.heartbeat(1, 'w2')
+
+
+def test_job_fails_after_max_attempts(jobs, clock):
+    jobs.submit('a', {})
+    for attempt in range(1, jobs.max_attempts + 1):
+        assert jobs.claim(f'w{attempt}')[2] == attempt
+        clock.now += jobs.lease + 1
+    # Задание, которое трижды уронило обработчик, больше не берется
+    assert jobs.claim('w4') is None
+    stats = jobs.stats()
+    assert (stats['queued'], stats['failed']) == (0, 1)
+
+
+def test_failed_attempt_is_requeued(jobs):
+    jobs.submit('a', {})
+    for attempt in range(1, jobs.max_attempts):
+        assert jobs.claim('w1')[2] == attempt
+        assert jobs.fail(1, 'w1', 'ошибка')
+    assert jobs.claim('w1')[2] == jobs.max_attempts
+    assert not jobs.fail(1, 'w1', 'ошибка')
+    assert jobs.claim('w1') is None
+    assert jobs.stats()['failed'] == 1
+
+
+def test_fail_without_retry_is_final(jobs):
+    jobs.submit('a', {})
+    jobs.claim('w1')
+    assert not jobs.fail(1, 'w1', 'error', retry=False)
+    assert jobs.claim('w1') is None
+    assert jobs.stats()['failed'] == 1
+
+
+def test_checkpoints_survive_release_and_retry(jobs):
+    jobs.submit('a', {})
+    jobs.claim('w1')
+    jobs.save_checkpoint(1, 1, 'первая часть')
+    jobs.release(1, 'w1')
+    assert jobs.stats()['queued'] == 1
+
+    assert jobs.claim('w2')[0] == 1
+    jobs.save_checkpoint(1, 2, '')
+    assert jobs.fail(1, 'w2', 'ошибка')
+    assert jobs.checkpoints(1) == {1: 'первая часть', 2: ''}
+
+    jobs.claim('w2')
+    jobs.complete(1, 'w2')
+    assert jobs.checkpoints(1) == {}
+    assert jobs.stats()['processed'] == 1
+
+
+def test_stale_worker_cannot_finish_reclaimed_job(jobs, clock):
+    jobs.submit('a', {})
+    jobs.claim('w1')
+    jobs.save_checkpoint(1, 1, 'текст')
+    clock.now += jobs.lease + 1
+    jobs.claim('w2')
+
+    # Обработчик с потерянной арендой не завершает чужое задание и не стирает его контрольные точки
+    jobs.complete(1, 'w1')
+    assert jobs.checkpoints(1) == {1: 'текст'}
+    assert jobs.heartbeat(1, 'w2')
+
+
+def test_stats_count_live_workers(jobs, clock):
+    idle_workers(jobs, 'w1', 'w2')
+    jobs.submit('a', {})
+    jobs.claim('w1')
+    stats = jobs.stats()
+    assert (stats['workers'], stats['busy'], stats['utilisation']) == (2, 1, 0.5)
+
+    # Обработчик, который давно не обращался к очереди, не считается
+    clock.now += jobs.lease / 2
+    jobs.heartbeat(1, 'w1')
+    clock.now += jobs.lease / 2 + 1
+    assert jobs.stats()['workers'] == 1
@@ -0,0 +1,102 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from backends import FakeBackend
+from cache import TranscriptCache
+from jobqueue import JobCheckpoints, JobQueue, LeaseLost
+from pipeline import is_media_message, needs_seekable_input, process_recognition
+
+
+def document(mime_type):
+    return SimpleNamespace(content_type='document', document=SimpleNamespace(mime_type=mime_type))
+
+
+@pytest.mark.parametrize('content_type', ['voice', 'audio', 'video_note', 'video'])
+def test_media_messages_are_accepted(content_type):
+    assert is_media_message(SimpleNamespace(content_type=content_type))
+
+
+@pytest.mark.parametrize('mime_type', ['audio/ogg', 'audio/mpeg', 'video/mp4'])
+def test_audio_and_video_documents_are_accepted(mime_type):
+    assert is_media_message(document(mime_type))
+
+
+@pytest.mark.parametrize('mime_type', ['application/pdf', 'image/png', 'text/plain', None])
+def test_other_documents_are_rejected(mime_type):
+    assert not is_media_message(document(mime_type))
+
+
+def test_other_messages_are_rejected():
+    assert not is_media_message(SimpleNamespace(content_type='photo'))
+
+
+@pytest.mark.parametrize('content_type, mime_type, seekable', [
+    ('voice', 'audio/ogg', False),
+    ('audio', 'audio/mpeg', False),
+    ('audio', 'audio/x-m4a', True),
+    ('audio', 'audio/mp4', True),
+    ('video', 'video/mp4', True),
+    ('video', None, True),
+    ('video_note', None, True),
+    ('document', 'video/quicktime', True),
+    ('document', 'video/webm', False),
+])
+def test_mp4_family_needs_seekable_input(content_type, mime_type, seekable):
+    media = SimpleNamespace(mime_type=mime_type) if mime_type else SimpleNamespace()
+    message = SimpleNamespace(content_type=content_type, **{content_type: media})
+    assert needs_seekable_input(message) == seekable
+
+
+class RecordingReplies:
+    """Заглушка ответов, которая запоминает, что отправлено пользователю."""
+
+    def __init__(self, on_part=None):
+        self.sent = []
+        self.on_part = on_part
+
+    async def start_recognition(self, total):
+        pass
+
+    async def part(self, i, text):
+        self.sent.append(('part', i))
+        if self.on_part:
+            self.on_part(i)
+
+    async def part_failed(self, i, text):
+        self.sent.append(('part_failed', i))
+
+    async def finish(self, text):
+        self.sent.append(('finish', text))
+
+    async def send(self, text):
+        self.sent.append(('send', text))
+
+
+def test_lost_lease_stops_replies(tmp_path, chunk):
+    jobs = JobQueue(str(tmp_path / 'jobs.sqlite3'))
+    lost = threading.Event()
+    checkpoints = JobCheckpoints(jobs, 1, final=False, lost=lost)
+    # Аренда теряется после первой части: остальные отправит обработчик, который забрал задание
+    replies = RecordingReplies(on_part=lambda i: lost.set())
+    with pytest.raises(LeaseLost):
+        asyncio.run(process_recognition(replies, [chunk(seed) for seed in range(3)], FakeBackend(),
+                                        TranscriptCache(), 'file:fake:1', checkpoints, {}, retry=True))
+    assert replies.sent == [('part', 1)]
+    assert list(jobs.checkpoints(1)) == [1]
+    jobs.close()
+
+
+def test_lost_lease_is_not_reported_on_last_attempt(tmp_path, chunk):
+    jobs = JobQueue(str(tmp_path / 'jobs.sqlite3'))
+    lost = threading.Event()
+    lost.set()
+    checkpoints = JobCheckpoints(jobs, 1, final=True, lost=lost)
+    replies = RecordingReplies()
+    with pytest.raises(LeaseLost):
+        asyncio.run(process_recognition(replies, [chunk(seed) for seed in range(2)], FakeBackend(),
+                                        TranscriptCache(), 'file:fake:1', checkpoints, {}, retry=False))
+    assert replies.sent == []
+    jobs.close()
@@ -0,0 +1,175 @@
+import asyncio
+import time
+
+import pytest
+import speech_recognition as sr
+
+import recognition
+from audio import SAMPLE_RATE
+from backends import FakeBackend, RecognitionBackend
+from recognition import recognize_chunks, recognize_with_retry
+
+
+def results(chunks, backend, **kwargs):
+    async def collect():
+        texts = []
+        async for i, future in recognize_chunks(chunks, backend, **kwargs):
+            try:
+                texts.append((i, await future))
+            except sr.UnknownValueError:
+                texts.append((i, ''))
+        return texts
+
+    return asyncio.run(collect())
+
+
+async def chunk_stream(chunks):
+    for audio_data in chunks:
+        yield audio_data
+
+
+def test_resume_skips_done_chunks(chunk):
+    chunks = [chunk(seed) for seed in range(5)]
+    expected = results(chunks, FakeBackend())
+
+    backend = FakeBackend()
+    done = {1: expected[0][1], 2: ''}
+    resumed = results(chunk_stream(chunks), backend, done=done)
+
+    # Сохраненные куски отдаются как были, сервис вызывается только для остальных
+    assert resumed == [(1, expected[0][1]), (2, '')] + expected[2:]
+    assert backend.calls == 3
+
+
+class LatencyBackend(RecognitionBackend):
+    """Заглушка с задержкой, которая считает одновременные запросы."""
+
+    name = 'latency'
+
+    def __init__(self, latencies):
+        self.latencies = latencies
+        self.in_flight = 0
+        self.peak = 0
+
+    async def recognize_async(self, audio_data):
+        i = int(audio_data.frame_data[0])
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(self.latencies[i])
+        finally:
+            self.in_flight -= 1
+        return f'кусок {i}'
+
+
+def numbered(n):
+    """Куски, номер которых записан в первом байте, чтобы заглушка знала, какой кусок пришел."""
+    return [sr.AudioData(bytes([i]) * 2, SAMPLE_RATE, 2) for i in range(n)]
+
+
+def test_results_come_in_chunk_order():
+    # Поздние куски распознаются быстрее ранних
+    backend = LatencyBackend([0.2 - i * 0.02 for i in range(8)])
+    assert results(numbered(8), backend, max_in_flight=8) == [
+        (i + 1, f'кусок {i}') for i in range(8)
+    ]
+
+
+def test_in_flight_requests_are_bounded():
+    backend = LatencyBackend([0.1] * 12)
+    started = time.monotonic()
+    results(numbered(12), backend, max_in_flight=3)
+    wall = time.monotonic() - started
+    assert backend.peak == 3
+    # Параллельно: около четырех задержек, а не двенадцати
+    assert wall < 0.1 * 12 / 2
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Паузы между попытками без ожидания."""
+    sleeps = []
+
+    async def sleep(seconds):
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(recognition.asyncio, 'sleep', sleep)
+    return sleeps
+
+
+def test_request_errors_are_retried_with_backoff(sleeps):
+    attempts = []
+
+    async def flaky(audio_data):
+        attempts.append(audio_data)
+        if len(attempts) < 3:
+            raise sr.RequestError('сервис недоступен')
+        return 'текст'
+
+    assert asyncio.run(recognize_with_retry(flaky, 'кусок', max_retries=3)) == 'текст'
+    assert len(attempts) == 3
+    assert sleeps == [1, 2]
+
+
+def test_request_error_is_raised_after_last_attempt(sleeps):
+    async def failing(audio_data):
+        raise sr.RequestError('сервис недоступен')
+
+    with pytest.raises(sr.RequestError):
+        asyncio.run(recognize_with_retry(failing, 'кусок', max_retries=2))
+
+
+def test_unknown_value_is_not_retried(sleeps):
+    attempts = []
+
+    async def silent(audio_data):
+        attempts.append(audio_data)
+        raise sr.UnknownValueError()
+
+    with pytest.raises(sr.UnknownValueError):
+        asyncio.run(recognize_with_retry(silent, 'кусок', max_retries=3))
+    assert len(attempts) == 1
+    assert sleeps == []
+
+
+@pytest.mark.parametrize('max_retries', [0, -1])
+def test_at_least_one_attempt(max_retries):
+    async def recognize(audio_data):
+        return 'текст'
+
+    assert asyncio.run(recognize_with_retry(recognize, 'кусок', max_retries=max_retries)) == 'текст'
+
+
+def test_backoff_does_not_block_other_chunks():
+    # Пока первый кусок ждет повторной попытки, остальные распознаются в том же цикле событий
+    class FlakyBackend(LatencyBackend):
+        failed = False
+
+        async def recognize_async(self, audio_data):
+            if audio_data.frame_data[0] == 0 and not self.failed:
+                self.failed = True
+                raise sr.RequestError('сервис недоступен')
+            return await super().recognize_async(audio_data)
+
+    backend = FlakyBackend([0.05] * 4)
+    started = time.monotonic()
+    assert results(numbered(4), backend, max_in_flight=4, max_retries=2) == [
+        (i + 1, f'кусок {i}') for i in range(4)
+    ]
+    # Пауза перед повтором - секунда, а не секунда на каждый кусок
+    assert time.monotonic() - started < 2
+
+
+def test_failed_chunk_does_not_stop_others(sleeps, chunk):
+    backend = FakeBackend(error_rate=1.0)
+
+    async def collect():
+        numbers = []
+        # Результаты читаются во время обхода: после его конца незавершенные запросы отменяются
+        async for i, future in recognize_chunks([chunk(seed) for seed in range(3)], backend, max_retries=2):
+            numbers.append(i)
+            with pytest.raises(sr.RequestError):
+                await future
+        return numbers
+
+    assert asyncio.run(collect()) == [1, 2, 3]
@@ -0,0 +1,150 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from replies import MessageReplies, ProgressiveReplies, split_text
+
+
+async def call(bot, operation, *args, **kwargs):
+    return await operation(*args, **kwargs)
+
+
+class FakeBot:
+    """Bot API в памяти; edit_message_text можно задержать, как медленную сеть. Создается в цикле событий."""
+
+    def __init__(self):
+        self.messages = {}
+        self.calls = []
+        self.edit_started = asyncio.Event()
+        self.edit_release = asyncio.Event()
+        self.edit_release.set()
+        self.fail = False
+        self._next_id = 0
+
+    def _new(self, text):
+        if self.fail:
+            raise ConnectionError('network is down')
+        self._next_id += 1
+        self.messages[self._next_id] = text
+        return SimpleNamespace(message_id=self._next_id)
+
+    async def reply_to(self, message, text):
+        self.calls.append('reply_to')
+        return self._new(text)
+
+    async def send_message(self, chat_id, text):
+        self.calls.append('send_message')
+        return self._new(text)
+
+    async def edit_message_text(self, text, chat_id, message_id):
+        self.calls.append('edit_message_text')
+        self.edit_started.set()
+        await asyncio.wait_for(self.edit_release.wait(), 5)
+        if self.fail:
+            raise ConnectionError('network is down')
+        self.messages[message_id] = text
+
+    async def delete_message(self, chat_id, message_id):
+        self.calls.append('delete_message')
+        del self.messages[message_id]
+
+
+@pytest.fixture
+def message():
+    return SimpleNamespace(chat=SimpleNamespace(id=1))
+
+
+def test_split_text_respects_limit():
+    text = ' '.join(['слово'] * 2000)
+    pages = split_text(text, limit=100)
+    assert all(len(page) <= 100 for page in pages)
+    assert ' '.join(pages) == text
+
+
+def test_message_replies_send_part_per_message(message):
+    async def scenario():
+        bot = FakeBot()
+        replies = MessageReplies(bot, message, call)
+        await replies.start_recognition(2)
+        await replies.part(1, 'раз')
+        await replies.part(2, 'два')
+        await replies.finish('итог')
+        return bot
+
+    assert list(asyncio.run(scenario()).messages.values()) == [
+        '📝 Начинаю распознавание...', 'Часть 1: раз', 'Часть 2: два', 'итог', '✅ Обработка завершена!',
+    ]
+
+
+def test_progressive_replies_edit_one_message(message):
+    async def scenario():
+        bot = FakeBot()
+        replies = ProgressiveReplies(bot, message, call, min_interval=0)
+        await replies.start_recognition(2)
+        await replies.part(1, 'раз')
+        await replies.part_failed(2, '⚠️ Часть 2: речь не распознана.')
+        await replies.finish('📄 Полный текст:\n\nраз')
+        return bot
+
+    assert list(asyncio.run(scenario()).messages.values()) == [
+        '📄 Полный текст:\n\nраз\n\n⚠️ Часть 2: речь не распознана.'
+    ]
+
+
+def test_progressive_part_does_not_wait_for_network(message):
+    async def scenario():
+        bot = FakeBot()
+        replies = ProgressiveReplies(bot, message, call, min_interval=0)
+        await replies.start_recognition(None)
+
+        # Правка зависла в сети в другой задаче
+        bot.edit_release.clear()
+        editing = asyncio.ensure_future(replies.part(1, 'раз'))
+        await asyncio.wait_for(bot.edit_started.wait(), 5)
+
+        started = time.monotonic()
+        await replies.part(2, 'два')
+        assert time.monotonic() - started < 1
+
+        # Текст, пришедший во время отправки, уходит следом
+        bot.edit_release.set()
+        await asyncio.wait_for(editing, 5)
+        deadline = time.monotonic() + 5
+        while 'два' not in bot.messages[1] and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        return bot
+
+    assert asyncio.run(scenario()).messages[1].endswith('раз два')
+
+
+def test_progressive_edits_are_coalesced(message):
+    async def scenario():
+        bot = FakeBot()
+        replies = ProgressiveReplies(bot, message, call, min_interval=0.2)
+        await replies.start_recognition(3)
+        for i in range(1, 4):
+            await replies.part(i, f'часть{i}')
+        # Части пришли быстрее min_interval: все они уйдут одной отложенной правкой
+        assert bot.calls == ['reply_to']
+        await asyncio.sleep(0.4)
+        return bot
+
+    bot = asyncio.run(scenario())
+    assert bot.calls == ['reply_to', 'edit_message_text']
+    assert bot.messages[1].endswith('часть1 часть2 часть3')
+
+
+def test_progressive_finish_raises_when_not_delivered(message):
+    async def scenario():
+        bot = FakeBot()
+        replies = ProgressiveReplies(bot, message, call, min_interval=0)
+        await replies.start_recognition(1)
+        bot.fail = True
+        # Промежуточная правка только пишется в журнал, а итог должен дойти до пользователя
+        await replies.part(1, 'раз')
+        await replies.finish('итог')
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(scenario())
@@ -0,0 +1,186 @@
+import asyncio
+import queue
+import threading
+import time
+
+import pytest
+
+from scheduler import AsyncJobScheduler, JobScheduler
+
+
+@pytest.fixture
+def make_scheduler():
+    schedulers = []
+
+    def make(**kwargs):
+        scheduler = JobScheduler(**kwargs)
+        schedulers.append(scheduler)
+        return scheduler
+
+    yield make
+    for scheduler in schedulers:
+        scheduler.stop(timeout=5)
+
+
+class Blocker:
+    """Задача, которая выполняется, пока ее не отпустят."""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.released = threading.Event()
+
+    def __call__(self):
+        self.started.set()
+        assert self.released.wait(5)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_jobs_of_one_chat_run_in_order():
+    scheduler = JobScheduler(workers=4, max_queue=50)
+    done = []
+    running = set()
+    lock = threading.Lock()
+
+    def job(key, i):
+        with lock:
+            # Задачи одного чата не выполняются одновременно
+            assert key not in running
+            running.add(key)
+        time.sleep(0.01)
+        with lock:
+            running.discard(key)
+            done.append((key, i))
+
+    for i in range(5):
+        for key in ('a', 'b', 'c'):
+            scheduler.submit(key, job, key, i)
+    wait_for(lambda: len(done) == 15)
+    scheduler.stop(timeout=5)
+
+    for key in ('a', 'b', 'c'):
+        assert [i for k, i in done if k == key] == list(range(5))
+
+
+def test_submit_returns_position(make_scheduler):
+    scheduler = make_scheduler(workers=2, max_queue=10)
+    blocker = Blocker()
+    assert scheduler.submit('a', blocker) == 0
+    assert blocker.started.wait(5)
+
+    # Свободный обработчик есть, но чат 'a' занят: сообщение ждет в очереди
+    assert scheduler.submit('a', lambda: None) == 1
+    # Другой чат сразу занимает свободный обработчик
+    other = Blocker()
+    assert scheduler.submit('b', other) == 0
+    assert other.started.wait(5)
+    # Свободных обработчиков не осталось
+    assert scheduler.submit('c', lambda: None) == 2
+    blocker.released.set()
+    other.released.set()
+
+
+def test_full_queue_raises(make_scheduler):
+    scheduler = make_scheduler(workers=1, max_queue=2)
+    blocker = Blocker()
+    scheduler.submit('a', blocker)
+    assert blocker.started.wait(5)
+    scheduler.submit('b', lambda: None)
+    scheduler.submit('c', lambda: None)
+    with pytest.raises(queue.Full):
+        scheduler.submit('d', lambda: None)
+    assert scheduler.stats()['queued'] == 2
+    blocker.released.set()
+
+
+def test_stop_drops_queued_jobs():
+    scheduler = JobScheduler(workers=1, max_queue=10)
+    blocker = Blocker()
+    ran = []
+    scheduler.submit('a', blocker)
+    assert blocker.started.wait(5)
+    scheduler.submit('b', ran.append, 'b')
+    scheduler.submit('c', ran.append, 'c')
+
+    # Выполняющаяся задача не прерывается, а ожидающие отбрасываются
+    scheduler.stop(timeout=0.1)
+    assert scheduler.stats()['queued'] == 0
+    blocker.released.set()
+    scheduler.stop(timeout=5)
+    assert ran == []
+    assert scheduler.stats()['processed'] == 1
+
+
+def test_running_job_counts_towards_utilisation(make_scheduler):
+    scheduler = make_scheduler(workers=1, max_queue=10)
+    blocker = Blocker()
+    scheduler.submit('a', blocker)
+    assert blocker.started.wait(5)
+    time.sleep(0.2)
+    stats = scheduler.stats()
+    assert stats['busy'] == 1
+    # Задача еще не завершена, но обработчик все это время был занят
+    assert stats['utilisation'] > 0.5
+    blocker.released.set()
+    wait_for(lambda: scheduler.stats()['busy'] == 0)
+    assert 0.5 < scheduler.stats()['utilisation'] <= 1.0
+
+
+def test_async_scheduler_runs_chats_in_order_and_bounds_concurrency():
+    done = []
+    running = set()
+    peak = 0
+
+    async def job(key, i):
+        nonlocal peak
+        # Задачи одного чата не выполняются одновременно
+        assert key not in running
+        running.add(key)
+        peak = max(peak, len(running))
+        await asyncio.sleep(0.01)
+        running.discard(key)
+        done.append((key, i))
+
+    async def scenario():
+        scheduler = AsyncJobScheduler(workers=2, max_queue=50)
+        positions = [scheduler.submit(key, job, key, i) for i in range(3) for key in ('a', 'b', 'c')]
+        while len(done) < 9:
+            await asyncio.sleep(0.01)
+        await scheduler.stop(timeout=5)
+        return positions, scheduler.stats()
+
+    positions, stats = asyncio.run(scenario())
+    # Первые два чата начинают сразу, остальные ждут свободного места
+    assert positions[:3] == [0, 0, 1]
+    assert peak == 2
+    assert stats['processed'] == 9
+    for key in ('a', 'b', 'c'):
+        assert [i for k, i in done if k == key] == list(range(3))
+
+
+def test_async_scheduler_stop_cancels_running_jobs():
+    cancelled = []
+
+    async def job():
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def scenario():
+        scheduler = AsyncJobScheduler(workers=1, max_queue=10)
+        scheduler.submit('a', job)
+        scheduler.submit('b', job)
+        await asyncio.sleep(0.05)
+        await scheduler.stop(timeout=0.1)
+        return scheduler.stats()
+
+    stats = asyncio.run(scenario())
+    assert cancelled == [True]
+    assert stats['queued'] == 0 and stats['busy'] == 0
@@ -0,0 +1,126 @@
+import asyncio
+import http.client
+import json
+import queue
+import threading
+
+import pytest
+
+import webhook
+from webhook import SECRET_HEADER, start_webhook_server, start_webhook_server_async
+
+PATH = '/telegram'
+SECRET = 'секрет'.encode().hex()
+
+UPDATE = {
+    'update_id': 1,
+    'message': {'message_id': 7, 'date': 0, 'chat': {'id': 42, 'type': 'private'}, 'text': 'привет'},
+}
+
+
+@pytest.fixture
+def server():
+    updates = queue.Queue()
+    server = start_webhook_server('127.0.0.1', 0, PATH, SECRET, updates.put)
+    server.updates = updates
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post(port, body=None, path=PATH, method='POST', secret=SECRET):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    try:
+        headers = {SECRET_HEADER: secret} if secret is not None else {}
+        if body is None:
+            body = json.dumps(UPDATE).encode()
+        connection.request(method, path, body=body, headers=headers)
+        return connection.getresponse().status
+    finally:
+        connection.close()
+
+
+def test_update_is_accepted(server):
+    assert post(server.server_address[1]) == 200
+    # Обновление передается обработчику уже после ответа
+    update = server.updates.get(timeout=5)
+    assert update.update_id == 1
+    assert update.message.text == 'привет'
+
+
+@pytest.mark.parametrize('request_args, status', [
+    ({'path': '/other'}, 404),
+    ({'path': '/telegram/extra'}, 404),
+    ({'method': 'GET', 'body': b''}, 405),
+    ({'secret': 'wrong'}, 403),
+    ({'secret': None}, 403),
+    ({'body': b'not json'}, 400),
+    ({'body': b'{}'}, 400),
+])
+def test_bad_requests_are_rejected(server, request_args, status):
+    assert post(server.server_address[1], **request_args) == status
+    assert server.updates.empty()
+
+
+def test_oversized_body_is_rejected(server, monkeypatch):
+    monkeypatch.setattr(webhook, 'MAX_BODY_SIZE', 16)
+    assert post(server.server_address[1]) == 413
+    assert server.updates.empty()
+
+
+def test_reply_is_sent_before_update_is_handled():
+    replied = threading.Event()
+    handled = []
+
+    def handle_update(update):
+        # Обработчик ждет, пока клиент получит ответ; если бы ответ шел после обработки, ожидание истекло бы
+        handled.append(replied.wait(5))
+
+    server = start_webhook_server('127.0.0.1', 0, PATH, SECRET, handle_update)
+    try:
+        assert post(server.server_address[1]) == 200
+        replied.set()
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert handled == [True]
+
+
+def test_handler_errors_do_not_affect_reply():
+    def handle_update(update):
+        raise RuntimeError('обработчик упал')
+
+    server = start_webhook_server('127.0.0.1', 0, PATH, SECRET, handle_update)
+    try:
+        assert post(server.server_address[1]) == 200
+        assert post(server.server_address[1]) == 200
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_async_server_replies_before_update_is_handled():
+    async def scenario():
+        replied = asyncio.Event()
+        handled = []
+
+        async def handle_update(update):
+            await asyncio.wait_for(replied.wait(), 5)
+            handled.append(update.update_id)
+
+        runner = await start_webhook_server_async('127.0.0.1', 0, PATH, SECRET, handle_update)
+        try:
+            port = runner.addresses[0][1]
+            loop = asyncio.get_running_loop()
+            statuses = [await loop.run_in_executor(None, lambda args=args: post(port, **args)) for args in (
+                {}, {'path': '/other'}, {'method': 'GET', 'body': b''}, {'secret': 'wrong'}, {'body': b'not json'},
+            )]
+            replied.set()
+            await asyncio.sleep(0.1)
+        finally:
+            await runner.cleanup()
+        return statuses, handled
+
+    statuses, handled = asyncio.run(scenario())
+    assert statuses == [200, 404, 405, 403, 400]
+    assert handled == [1]
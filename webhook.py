@@ -0,0 +1,132 @@
+"""
+Прием обновлений Telegram через вебхук.
+
+Telegram отправляет каждое обновление POST запросом на адрес, заданный
+через setWebhook, с секретом в заголовке X-Telegram-Bot-Api-Secret-Token.
+Локальный HTTP сервер проверяет секрет, сразу отвечает 200 и только после
+этого передает обновление обработчикам бота, поэтому медленная обработка
+не задерживает подтверждение, а ошибки исходящих запросов не останавливают
+прием новых сообщений.
+"""
+import asyncio
+import hmac
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+# Telegram не присылает обновления больше нескольких мегабайт, остальное отбрасываем
+MAX_BODY_SIZE = 1024 * 1024
+
+
+def _check(method, path, expected_path, secret, headers):
+    """Код ответа для запроса, не прошедшего проверку, или None."""
+    if path.split('?')[0] != expected_path:
+        return 404
+    if method != 'POST':
+        return 405
+    if not hmac.compare_digest(headers.get(SECRET_HEADER, ''), secret):
+        return 403
+    return None
+
+
+def _parse_update(body):
+    try:
+        return types.Update.de_json(json.loads(body))
+    except (ValueError, TypeError, KeyError) as e:
+        logger.warning(f"Некорректное обновление от вебхука: {e}")
+        return None
+
+
+def start_webhook_server(host, port, path, secret, handle_update):
+    """
+    Запускает HTTP сервер вебхука в фоновом потоке.
+
+    handle_update(update) вызывается в потоке запроса после того, как
+    Telegram уже получил ответ 200.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status):
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def _handle(self):
+            status = _check(self.command, self.path, path, secret, self.headers)
+            length = int(self.headers.get('Content-Length') or 0)
+            if status is None and length > MAX_BODY_SIZE:
+                status = 413
+            if status is not None:
+                metrics.inc('s2txt_webhook_updates_total', status=status)
+                self._reply(status)
+                return
+
+            update = _parse_update(self.rfile.read(length))
+            status = 200 if update is not None else 400
+            metrics.inc('s2txt_webhook_updates_total', status=status)
+            self._reply(status)
+            self.wfile.flush()
+            if update is None:
+                return
+            try:
+                handle_update(update)
+            except Exception as e:
+                logger.error(f"Ошибка обработки обновления из вебхука: {e}")
+
+        do_GET = _handle
+        do_POST = _handle
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='webhook', daemon=True).start()
+    logger.info(f"Вебхук принимает обновления на http://{host}:{server.server_address[1]}{path}")
+    return server
+
+
+async def start_webhook_server_async(host, port, path, secret, handle_update):
+    """
+    Асинхронный вариант start_webhook_server на aiohttp.
+
+    handle_update(update) - корутинная функция; она запускается отдельной
+    задачей, а ответ 200 отправляется не дожидаясь ее завершения.
+    Возвращает aiohttp.web.AppRunner, который нужно остановить через cleanup().
+    """
+    from aiohttp import web
+
+    tasks = set()
+
+    async def handle(request):
+        status = _check(request.method, request.path, path, secret, request.headers)
+        if status is None and (request.content_length or 0) > MAX_BODY_SIZE:
+            status = 413
+        update = None
+        if status is None:
+            update = _parse_update(await request.read())
+            status = 200 if update is not None else 400
+        metrics.inc('s2txt_webhook_updates_total', status=status)
+        if update is not None:
+            # Ссылка на задачу хранится до ее завершения, иначе ее может собрать GC
+            task = asyncio.create_task(handle_update(update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        return web.Response(status=status)
+
+    app = web.Application(client_max_size=MAX_BODY_SIZE)
+    app.router.add_route('*', '/{tail:.*}', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Вебхук принимает обновления на http://{host}:{port}{path}")
+    return runner
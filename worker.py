@@ -0,0 +1,158 @@
+"""
+Процессы-обработчики долговременной очереди заданий.
+
+Бот с заданным JOB_QUEUE_PATH только ставит голосовые сообщения в очередь,
+а этот скрипт запускает WORKER_PROCESSES процессов, которые забирают
+задания из очереди и обрабатывают их тем же конвейером, что и бот (каждое
+задание - в своем цикле событий, см. pipeline.run_voice_job). Процессы
+не делят GIL, поэтому декодирование и нарезка распределяются по ядрам.
+
+Пока задание обрабатывается, аренда продлевается в фоновом потоке. При
+остановке задание возвращается в очередь, а при падении процесса его
+заберет другой обработчик после истечения аренды. Если аренда все же
+потеряна (процесс завис дольше аренды), обработка прерывается и
+пользователю больше ничего не отправляется.
+
+Запуск (настройки те же, что и у бота):
+    JOB_QUEUE_PATH=jobs.sqlite3 python worker.py
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+from telebot import types
+
+from jobqueue import JobCheckpoints, LeaseLost
+from metrics import configure_trace_log, record_queue_wait, start_metrics_server
+from pipeline import configure_bot_api, create_backend, create_job_queue, run_voice_job
+from settings import JOB_QUEUE_PATH, METRICS_HOST, TOKEN, TRACE_LOG, WORKER_METRICS_PORT, WORKER_PROCESSES
+
+logger = logging.getLogger(__name__)
+
+# Пауза между проверками пустой очереди, секунд
+POLL_INTERVAL = 0.5
+
+
+def keep_lease(jobs, job_id, worker_id, stopped, lost):
+    """Продлевает аренду задания, пока оно обрабатывается; при потере аренды устанавливает lost."""
+    while not stopped.wait(jobs.lease / 3):
+        if not jobs.heartbeat(job_id, worker_id):
+            logger.warning(f"Аренда задания {job_id} потеряна, его обрабатывает другой обработчик")
+            lost.set()
+            return
+
+
+def run_worker(worker_id, metrics_port=None):
+    """Цикл одного процесса-обработчика; metrics_port - порт его сервера метрик."""
+    def stop(signum, frame):
+        # Прерываем текущее задание, чтобы вернуть его в очередь, а не ждать истечения аренды;
+        # повторный сигнал не должен прервать само возвращение
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    configure_bot_api()
+    jobs = create_job_queue()
+    transcript_cache, backend = create_backend()
+    configure_trace_log(TRACE_LOG)
+    # У каждого процесса свои метрики, поэтому и свой сервер
+    metrics_server = start_metrics_server(METRICS_HOST, metrics_port) if metrics_port else None
+    logger.info(f"Обработчик {worker_id} запущен")
+
+    try:
+        while True:
+            job = jobs.claim(worker_id)
+            if job is None:
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            job_id, payload, attempt, queued_at = job
+            record_queue_wait(max(time.time() - queued_at, 0.0))
+            stopped = threading.Event()
+            lost = threading.Event()
+            heartbeat = threading.Thread(target=keep_lease, args=(jobs, job_id, worker_id, stopped, lost),
+                                         daemon=True)
+            heartbeat.start()
+            try:
+                message = types.Message.de_json(payload)
+                # До последней попытки ошибки выбрасываются, и задание повторяется; на последней
+                # пользователь получает сообщение об ошибке, и задание отмечается неудачным
+                checkpoints = JobCheckpoints(jobs, job_id, final=attempt >= jobs.max_attempts, lost=lost)
+                outcome = run_voice_job(TOKEN, message, backend, transcript_cache, checkpoints)
+                if outcome in ('error', 'timeout'):
+                    jobs.fail(job_id, worker_id, outcome, retry=False)
+                else:
+                    # Итоговый ответ уже отправлен
+                    jobs.complete(job_id, worker_id)
+            except LeaseLost:
+                # Задание принадлежит другому обработчику, отмечать его здесь нельзя
+                logger.warning(f"Обработка задания {job_id} прервана: аренда потеряна")
+            except KeyboardInterrupt:
+                jobs.release(job_id, worker_id)
+                logger.info(f"Задание {job_id} возвращено в очередь")
+                raise
+            except Exception as e:
+                if jobs.fail(job_id, worker_id, e):
+                    logger.warning(f"Ошибка задания {job_id} (попытка {attempt}): {e}. Задание будет повторено")
+                else:
+                    logger.error(f"Ошибка задания {job_id}: {e}")
+            finally:
+                stopped.set()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if metrics_server:
+            metrics_server.shutdown()
+        jobs.close()
+        transcript_cache.close()
+        logger.info(f"Обработчик {worker_id} остановлен")
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[logging.FileHandler('bot.log'), logging.StreamHandler()]
+    )
+    if not TOKEN:
+        logger.error("Токен не найден!")
+        sys.exit(1)
+    if not JOB_QUEUE_PATH:
+        logger.error("Не задан JOB_QUEUE_PATH: обработчикам неоткуда брать задания")
+        sys.exit(1)
+
+    prefix = f'{socket.gethostname()}:{os.getpid()}'
+    if WORKER_PROCESSES <= 1:
+        run_worker(prefix, WORKER_METRICS_PORT)
+        return
+
+    processes = [
+        multiprocessing.Process(target=run_worker, name=f'worker-{i}',
+                                args=(f'{prefix}:{i}', WORKER_METRICS_PORT + i if WORKER_METRICS_PORT else None))
+        for i in range(WORKER_PROCESSES)
+    ]
+    for process in processes:
+        process.start()
+
+    def stop(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for process in processes:
+        process.join()
+    logger.info("Все обработчики остановлены")
+
+
+if __name__ == '__main__':
+    main()